@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from spleeter.audio.adapter import AudioAdapter
+
+from api.separators.bs_roformer_separator import BSRoformerSeparator
+
+"""
+This module defines a management command that compares the speed and quality of BS-RoFormer inference modes on
+the CPU, e.g. int8 quantization or bf16 against fp32.
+"""
+
+# Separator arguments of each benchmarked mode, fully specified so that BS_ROFORMER_PRECISION does not apply
+MODES = {
+    'fp32': {'quantize': False, 'precision': 'fp32'},
+    'int8': {'quantize': True, 'precision': 'fp32'},
+    'bf16': {'quantize': False, 'precision': 'bf16'},
+}
+
+
+def get_sdr(reference: np.ndarray, estimate: np.ndarray) -> float:
+    """Return the signal-to-distortion ratio (dB) of an estimate against a reference."""
+    noise = np.sum((reference - estimate)**2)
+    return 10 * np.log10(np.sum(reference**2) / max(noise, 1e-10))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the speed and quality of BS-RoFormer inference modes on the CPU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Path to the audio file to separate')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of audio to separate')
+        parser.add_argument('--modes',
+                            nargs='+',
+                            choices=MODES.keys(),
+                            default=list(MODES.keys()),
+                            help='Modes to benchmark, the first one being the quality reference')
+
+    def handle(self, *args, **options):
+        sample_rate = 44100
+        waveform, _ = AudioAdapter.default().load(options['input'],
+                                                  duration=options['duration'],
+                                                  sample_rate=sample_rate)
+        mix = waveform.T
+        duration = mix.shape[-1] / sample_rate
+
+        reference = None
+        for mode in options['modes']:
+            separator = BSRoformerSeparator(cpu_separation=True, stem_mode=BSRoformerSeparator.STEM_MODE_6,
+                                            **MODES[mode])
+            # Load the model and warm up kernels before timing
+            with separator.open_model() as model:
+                separator.warmup()
+
+                start = time.perf_counter()
+                sources = separator.demix(mix, model)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(f'{mode}: {elapsed:.2f} s ({duration / elapsed:.2f}x real time)')
+
+            if reference is None:
+                reference = sources
+                continue
+            sdrs = {name: get_sdr(reference[name], source) for name, source in sources.items()}
+            sdr_info = ', '.join(f'{name} {sdr:.1f} dB' for name, sdr in sdrs.items())
+            self.stdout.write(f'{mode} SDR against {options["modes"][0]}: {sdr_info}')
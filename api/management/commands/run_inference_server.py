@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.separators.bs_roformer_separator import BSRoformerSeparator
+from api.separators.inference_server import DEFAULT_SECRET_KEYS, InferenceServer
+from api.separators.model_cache import model_cache
+
+"""
+This module defines a management command that runs the local inference server shared by the separation workers
+of a host.
+"""
+
+
+def load_model(model_args):
+    """Return the cached model for the model arguments sent by a worker, loading it on first use."""
+    separator = BSRoformerSeparator(cpu_separation=settings.CPU_SEPARATION, use_inference_server=False,
+                                    **model_args)
+    return separator.get_model()
+
+
+class Command(BaseCommand):
+    help = 'Run the inference server that batches BS-RoFormer segments across the separation workers of this host'
+
+    def handle(self, *args, **options):
+        if not settings.INFERENCE_SERVER_ADDRESS:
+            raise CommandError('INFERENCE_SERVER_ADDRESS must be set to the path of the socket to listen on.')
+        if settings.SECRET_KEY in DEFAULT_SECRET_KEYS:
+            raise CommandError('SECRET_KEY must be changed from its default, as it authenticates inference clients.')
+
+        # The server holds the models of all jobs of the host, e.g. in different precision or quantization modes
+        model_cache.max_models = settings.INFERENCE_SERVER_MODEL_CACHE_SIZE
+
+        # Load the default model before accepting clients
+        load_model(BSRoformerSeparator(use_inference_server=False).get_model_args())
+
+        server = InferenceServer(settings.INFERENCE_SERVER_ADDRESS, load_model,
+                                 settings.INFERENCE_SERVER_MAX_BATCH_SIZE,
+                                 settings.INFERENCE_SERVER_MAX_DELAY / 1000)
+        server.serve_forever()
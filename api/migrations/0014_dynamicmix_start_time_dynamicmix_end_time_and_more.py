@@ -0,0 +1,49 @@
+# Generated by Django 4.2.26 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_alter_staticmix_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='dynamicmix',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='staticmix',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='dynamicmix',
+            name='end_time',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dynamicmix',
+            name='start_time',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='staticmix',
+            name='end_time',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='staticmix',
+            name='start_time',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dynamicmix',
+            unique_together={('source_track', 'separator', 'separator_args', 'bitrate', 'start_time', 'end_time')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='staticmix',
+            unique_together={('source_track', 'separator', 'separator_args', 'bitrate', 'vocals', 'drums', 'bass', 'other', 'guitar', 'piano', 'start_time', 'end_time')},
+        ),
+    ]
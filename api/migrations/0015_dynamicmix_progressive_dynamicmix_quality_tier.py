@@ -0,0 +1,31 @@
+# Generated by Django 4.2.26 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+def mark_done_mixes_final(apps, schema_editor):
+    """Mark the stems of existing finished dynamic mixes as final."""
+    DynamicMix = apps.get_model('api', 'DynamicMix')
+    # TaskStatus.DONE and QualityTier.FINAL
+    DynamicMix.objects.filter(status=2).update(quality_tier=2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_dynamicmix_start_time_dynamicmix_end_time_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicmix',
+            name='progressive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dynamicmix',
+            name='quality_tier',
+            field=models.IntegerField(choices=[(0, 'None'), (1, 'Preview'), (2, 'Final')], default=0),
+        ),
+        migrations.RunPython(mark_done_mixes_final, migrations.RunPython.noop),
+    ]
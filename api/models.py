@@ -51,6 +51,15 @@ BS_ROFORMER_FAMILY = [
     BS_ROFORMER, BS_ROFORMER_5S_GUITAR, BS_ROFORMER_5S_PIANO, BS_ROFORMER_6S
 ]
 
+# Precision modes of BS-RoFormer separation, selected with the 'precision' separator arg
+BS_ROFORMER_PRECISIONS = ['fp32', 'bf16']
+
+# Speed/quality presets of BS-RoFormer and Demucs separation, selected with the 'preset' separator arg
+PRESET_DRAFT = 'draft'
+PRESET_STANDARD = 'standard'
+PRESET_MAX = 'max'
+PRESETS = [PRESET_DRAFT, PRESET_STANDARD, PRESET_MAX]
+
 DEMUCS4_HT = 'htdemucs'
 DEMUCS4_HT_FT = 'htdemucs_ft'
 DEMUCS3_MMI = 'hdemucs_mmi'
@@ -110,6 +119,28 @@ SEP_CHOICES = [
     (XUMX, 'X-UMX')
 ]
 
+def get_preset_labels(separator_args) -> list:
+    """Return the label of the preset in the separator args, e.g. ['draft'], or none for the standard preset."""
+    preset = separator_args.get('preset', PRESET_STANDARD)
+    return [preset] if preset != PRESET_STANDARD else []
+
+def get_time_range_labels(start_time: float, end_time: float) -> list:
+    """Return the label of the time range of a mix, e.g. ['30s-60s'], or none if it covers the whole track."""
+    if not start_time and not end_time:
+        return []
+    end = f'{end_time:g}s' if end_time else 'end'
+    return [f'{start_time:g}s-{end}']
+
+def get_bs_roformer_arg_labels(separator_args) -> list:
+    """Return short labels of the non-default BS-RoFormer separator args, e.g. ['int8']."""
+    labels = get_preset_labels(separator_args)
+    if separator_args.get('quantize', False):
+        labels.append('int8')
+    precision = separator_args.get('precision', 'fp32')
+    if precision != 'fp32':
+        labels.append(precision)
+    return labels
+
 class TaskStatus(models.IntegerChoices):
     """
     Enum for status of a task.
@@ -119,6 +150,14 @@ class TaskStatus(models.IntegerChoices):
     DONE = 2, 'Done'
     ERROR = -1, 'Error'
 
+class QualityTier(models.IntegerChoices):
+    """
+    Enum for the quality of the stems currently available for a dynamic mix.
+    """
+    NONE = 0, 'None'
+    PREVIEW = 1, 'Preview'
+    FINAL = 2, 'Final'
+
 class OutputFormat(models.IntegerChoices):
     """
     Enum for output formats.
@@ -289,6 +328,10 @@ class StaticMix(models.Model):
     source_track = models.ForeignKey(SourceTrack,
                                      related_name='static',
                                      on_delete=models.CASCADE)
+    # Start of the separated time range of the source track, in seconds
+    start_time = models.FloatField(default=0)
+    # End of the separated time range of the source track in seconds, or 0 for the end of the track
+    end_time = models.FloatField(default=0)
     # Whether track contains vocals
     vocals = models.BooleanField()
     # Whether track contains drums
@@ -335,6 +378,8 @@ class StaticMix(models.Model):
         "Artist - Title (vocals, drums, bass, other)"
         """
         prefix_lst = [self.source_track.artist, ' - ', self.source_track.title]
+        for label in get_time_range_labels(self.start_time, self.end_time):
+            prefix_lst.append(f' {label}')
         parts_lst = []
         if self.vocals:
             parts_lst.append('vocals')
@@ -353,9 +398,14 @@ class StaticMix(models.Model):
         parts = ','.join(parts_lst)
 
         suffix = f'{self.get_bitrate_display()},{self.separator}'
-        if self.separator in DEMUCS_FAMILY:
+        if self.separator in BS_ROFORMER_FAMILY:
+            for label in get_bs_roformer_arg_labels(self.separator_args):
+                suffix += f',{label}'
+        elif self.separator in DEMUCS_FAMILY:
             random_shifts = self.separator_args['random_shifts']
             suffix += f',{random_shifts} shifts'
+            for label in get_preset_labels(self.separator_args):
+                suffix += f',{label}'
         elif self.separator == XUMX:
             iterations = self.separator_args['iterations']
             softmask = self.separator_args['softmask']
@@ -388,13 +438,14 @@ class StaticMix(models.Model):
             #     BS_ROFORMER_5S_PIANO: '5 stems (Piano)',
             #     BS_ROFORMER_6S: '6 stems',
             # }
-            return [f'{self.get_bitrate_display()}']
+            return [f'{self.get_bitrate_display()}', *get_bs_roformer_arg_labels(self.separator_args)]
         elif self.separator == D3NET:
             return [f'{self.get_bitrate_display()}']
         elif self.separator in DEMUCS_FAMILY:
             return [
                 f'{self.get_bitrate_display()}',
-                f'Random shifts: {self.separator_args["random_shifts"]}'
+                f'Random shifts: {self.separator_args["random_shifts"]}',
+                *get_preset_labels(self.separator_args)
             ]
         else:
             info_arr = [
@@ -410,7 +461,7 @@ class StaticMix(models.Model):
     class Meta:
         unique_together = [[
             'source_track', 'separator', 'separator_args', 'bitrate',
-            'vocals', 'drums', 'bass', 'other', 'guitar', 'piano'
+            'vocals', 'drums', 'bass', 'other', 'guitar', 'piano', 'start_time', 'end_time'
         ]]
 
 # pylint: disable=unsubscriptable-object
@@ -433,6 +484,10 @@ class DynamicMix(models.Model):
     source_track = models.ForeignKey(SourceTrack,
                                      related_name='dynamic',
                                      on_delete=models.CASCADE)
+    # Start of the separated time range of the source track, in seconds
+    start_time = models.FloatField(default=0)
+    # End of the separated time range of the source track in seconds, or 0 for the end of the track
+    end_time = models.FloatField(default=0)
     # Path to vocals file
     vocals_file = models.FileField(upload_to=mix_track_path,
                                    max_length=255,
@@ -464,6 +519,11 @@ class DynamicMix(models.Model):
     # Status of source separation task
     status = models.IntegerField(choices=TaskStatus.choices,
                                  default=TaskStatus.QUEUED)
+    # Whether to first publish provisional stems separated by Spleeter, replaced once the separator finishes
+    progressive = models.BooleanField(default=False)
+    # Quality of the stems currently available
+    quality_tier = models.IntegerField(choices=QualityTier.choices,
+                                       default=QualityTier.NONE)
     # Error message
     error = models.TextField(blank=True)
     # DateTime when source separation task was started
@@ -482,9 +542,10 @@ class DynamicMix(models.Model):
     def formatted_prefix(self):
         """
         Produce a string with the format like:
-        "Artist - Title"
+        "Artist - Title" or "Artist - Title 30s-60s"
         """
-        return f'{self.source_track.artist} - {self.source_track.title}'
+        labels = ''.join(f' {label}' for label in get_time_range_labels(self.start_time, self.end_time))
+        return f'{self.source_track.artist} - {self.source_track.title}{labels}'
 
     def formatted_suffix(self):
         """
@@ -494,12 +555,14 @@ class DynamicMix(models.Model):
         if self.separator == SPLEETER or self.separator == SPLEETER_PIANO:
             return f'[{self.get_bitrate_display()},{self.separator}]'
         elif self.separator in BS_ROFORMER_FAMILY:
-            return f'[{self.get_bitrate_display()},{self.separator}]'
+            labels = ''.join(f',{label}' for label in get_bs_roformer_arg_labels(self.separator_args))
+            return f'[{self.get_bitrate_display()},{self.separator}{labels}]'
         elif self.separator == D3NET:
             return f'[{self.get_bitrate_display()}]'
         elif self.separator in DEMUCS_FAMILY:
             random_shifts = self.separator_args['random_shifts']
-            return f'[{self.get_bitrate_display()},{self.separator},{random_shifts} shifts]'
+            labels = ''.join(f',{label}' for label in get_preset_labels(self.separator_args))
+            return f'[{self.get_bitrate_display()},{self.separator},{random_shifts} shifts{labels}]'
         else:
             iterations = self.separator_args['iterations']
             softmask = self.separator_args['softmask']
@@ -569,13 +632,14 @@ class DynamicMix(models.Model):
             #     BS_ROFORMER_5S_PIANO: '5 stems (Piano)',
             #     BS_ROFORMER_6S: '6 stems',
             # }
-            return [f'{self.get_bitrate_display()}']
+            return [f'{self.get_bitrate_display()}', *get_bs_roformer_arg_labels(self.separator_args)]
         elif self.separator == D3NET:
             return [f'{self.get_bitrate_display()}']
         elif self.separator in DEMUCS_FAMILY:
             random_shifts = self.separator_args['random_shifts']
             return [
-                f'{self.get_bitrate_display()}', f'Random shifts: {random_shifts}'
+                f'{self.get_bitrate_display()}', f'Random shifts: {random_shifts}',
+                *get_preset_labels(self.separator_args)
             ]
         else:
             info_arr = [
@@ -591,5 +655,5 @@ class DynamicMix(models.Model):
 
     class Meta:
         unique_together = [[
-            'source_track', 'separator', 'separator_args', 'bitrate'
+            'source_track', 'separator', 'separator_args', 'bitrate', 'start_time', 'end_time'
         ]]
@@ -0,0 +1,123 @@
+from typing import Optional
+
+import ffmpeg
+import numpy as np
+
+"""
+This module defines FFmpeg-backed audio readers and writers that decode and encode audio incrementally,
+so that long tracks can be processed without holding the whole waveform in memory.
+"""
+
+# Mirrors the codec mapping used by Spleeter's FFMPEGProcessAudioAdapter
+FFMPEG_CODECS = {'m4a': 'aac', 'ogg': 'libvorbis', 'wma': 'wmav2'}
+
+
+class AudioStreamReader:
+    """Decodes an audio file into float32 chunks of shape (channels, samples)."""
+    def __init__(self, path: str, sample_rate: int, channels: int = 2, offset: float = 0.,
+                 duration: Optional[float] = None):
+        """
+        :param path: Path or URL of the audio file
+        :param sample_rate: Sample rate to resample to
+        :param channels: Number of channels to up/down-mix to
+        :param offset: Time in seconds to start decoding at
+        :param duration: Maximum duration in seconds to decode, or None to decode until the end
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.offset = offset
+        self.duration = duration
+        self.eof = False
+        self.process = None
+
+    def __enter__(self):
+        input_kwargs = {}
+        if self.offset:
+            input_kwargs['ss'] = self.offset
+        if self.duration is not None:
+            input_kwargs['t'] = self.duration
+        self.process = (ffmpeg.input(self.path, **input_kwargs).output(
+            'pipe:', format='f32le', ar=self.sample_rate, ac=self.channels).global_args(
+                '-loglevel', 'error').run_async(pipe_stdout=True, pipe_stderr=True))
+        return self
+
+    def read(self, num_samples: int) -> np.ndarray:
+        """
+        Read up to num_samples samples. Fewer samples are returned once the end of the stream is reached,
+        after which eof is set.
+        """
+        frame_size = 4 * self.channels
+        data = self.process.stdout.read(num_samples * frame_size)
+        if len(data) < num_samples * frame_size:
+            self.eof = True
+        data = data[:len(data) - len(data) % frame_size]
+        return np.frombuffer(data, dtype='<f4').reshape(-1, self.channels).T.copy()
+
+    def skip(self, num_samples: int, chunk_size: int = 1 << 20):
+        """Decode and discard up to num_samples samples, e.g. to start reading at an exact sample offset."""
+        while num_samples > 0 and not self.eof:
+            num_samples -= self.read(min(num_samples, chunk_size)).shape[-1]
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.stdout.close()
+        # Readers may stop before the end of the stream, e.g. after reading a chunk of a track
+        killed = exc_type is not None or not self.eof
+        if killed:
+            self.process.kill()
+        self.process.wait()
+        if not killed and self.process.returncode != 0:
+            raise RuntimeError(f'FFmpeg error: {self.process.stderr.read().decode()}')
+        self.process.stderr.close()
+
+
+class AudioStreamWriter:
+    """Encodes float32 chunks of shape (channels, samples) into an audio file."""
+    def __init__(self, path: str, sample_rate: int, channels: int, codec: str, bitrate: str = None,
+                 sample_fmt: Optional[str] = None):
+        """
+        :param path: Output file path
+        :param sample_rate: Sample rate of the audio
+        :param channels: Number of channels of the audio
+        :param codec: Output codec/file extension (e.g. 'mp3', 'flac', 'wav')
+        :param bitrate: Output bitrate for lossy codecs (e.g. '256k')
+        :param sample_fmt: FFmpeg sample format to encode (e.g. 's32'), defaults to the choice of the encoder
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.codec = codec
+        self.bitrate = bitrate
+        self.sample_fmt = sample_fmt
+        self.process = None
+
+    def __enter__(self):
+        output_kwargs = {'ar': self.sample_rate, 'strict': '-2'}
+        if self.bitrate:
+            output_kwargs['audio_bitrate'] = self.bitrate
+        if self.sample_fmt:
+            output_kwargs['sample_fmt'] = self.sample_fmt
+        if self.codec is not None and self.codec != 'wav':
+            output_kwargs['codec'] = FFMPEG_CODECS.get(self.codec, self.codec)
+        self.process = (ffmpeg.input('pipe:', format='f32le', ar=self.sample_rate,
+                                     ac=self.channels).output(str(self.path), **output_kwargs).global_args(
+                                         '-loglevel', 'error').overwrite_output().run_async(pipe_stdin=True,
+                                                                                             pipe_stderr=True))
+        return self
+
+    def write(self, data: np.ndarray):
+        """Encode a chunk of audio of shape (channels, samples)."""
+        try:
+            self.process.stdin.write(np.ascontiguousarray(data.T, dtype='<f4').tobytes())
+        except IOError:
+            raise RuntimeError(f'FFmpeg error: {self.process.stderr.read().decode()}')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.process.kill()
+            self.process.wait()
+            return
+        self.process.stdin.close()
+        self.process.wait()
+        if self.process.returncode != 0:
+            raise RuntimeError(f'FFmpeg error: {self.process.stderr.read().decode()}')
@@ -16,6 +16,11 @@ Code adapted from https://github.com/Anjok07/ultimatevocalremovergui/blob/v5.6.0
 
 FlashAttentionConfig = namedtuple('FlashAttentionConfig', ['enable_flash', 'enable_math', 'enable_mem_efficient'])
 
+# upper bound on the size of the similarity matrix materialized at once by the non-flash path,
+# above which queries are processed in chunks
+
+MAX_SIM_BYTES = 64 * 1024 ** 2
+
 # helpers
 
 def exists(val):
@@ -41,12 +46,14 @@ class Attend(nn.Module):
         self,
         dropout = 0.,
         flash = False,
-        scale = None
+        scale = None,
+        max_sim_bytes = MAX_SIM_BYTES
     ):
         super().__init__()
         self.dropout = dropout
         self.attn_dropout = nn.Dropout(dropout)
         self.scale = scale
+        self.max_sim_bytes = max_sim_bytes
 
         self.flash = flash
         assert not (flash and version.parse(torch.__version__) < version.parse('2.0.0')), 'in order to use flash attention, you must be using pytorch 2.0 or above'
@@ -75,15 +82,41 @@ class Attend(nn.Module):
         config = self.cuda_config if is_cuda else self.cpu_config
 
         # pytorch 2.0 flash attn: q, k, v, mask, dropout, softmax_scale
+        # the cpu config enables every kernel, which is the default, so the backend context is only entered on cuda
+        # (entering it causes a graph break under torch.compile)
+
+        dropout_p = self.dropout if self.training else 0.
+
+        if not is_cuda:
+            return F.scaled_dot_product_attention(q, k, v, dropout_p = dropout_p)
 
         with torch.backends.cuda.sdp_kernel(**config._asdict()):
-            out = F.scaled_dot_product_attention(
-                q, k, v,
-                dropout_p = self.dropout if self.training else 0.
-            )
+            out = F.scaled_dot_product_attention(q, k, v, dropout_p = dropout_p)
 
         return out
 
+    def get_query_chunk_size(self, q, k):
+        """
+        number of queries whose similarities to all keys fit within max_sim_bytes, at least 1
+        """
+        batch, heads, q_len, k_len = q.shape[0], q.shape[1], q.shape[-2], k.shape[-2]
+        row_bytes = batch * heads * k_len * q.element_size()
+        return min(q_len, max(1, self.max_sim_bytes // max(row_bytes, 1)))
+
+    def attend(self, q, k, v, scale):
+        # similarity
+
+        sim = einsum(f"b h i d, b h j d -> b h i j", q, k) * scale
+
+        # attention
+
+        attn = sim.softmax(dim=-1)
+        attn = self.attn_dropout(attn)
+
+        # aggregate values
+
+        return einsum(f"b h i j, b h j d -> b h i d", attn, v)
+
     def forward(self, q, k, v):
         """
         einstein notation
@@ -100,17 +133,12 @@ class Attend(nn.Module):
         if self.flash:
             return self.flash_attn(q, k, v)
 
-        # similarity
-
-        sim = einsum(f"b h i d, b h j d -> b h i j", q, k) * scale
-
-        # attention
+        # the softmax is taken over keys independently for each query, so attending chunks of queries
+        # gives the same output while bounding the size of the similarity matrix
 
-        attn = sim.softmax(dim=-1)
-        attn = self.attn_dropout(attn)
+        chunk_size = self.get_query_chunk_size(q, k)
 
-        # aggregate values
-
-        out = einsum(f"b h i j, b h j d -> b h i d", attn, v)
+        if chunk_size >= q_len:
+            return self.attend(q, k, v, scale)
 
-        return out
+        return torch.cat([self.attend(q_chunk, k, v, scale) for q_chunk in q.split(chunk_size, dim = -2)], dim = -2)
@@ -12,7 +12,7 @@ from beartype import beartype
 
 from rotary_embedding_torch import RotaryEmbedding
 
-from einops import rearrange, pack, unpack
+from einops import rearrange, pack, unpack, reduce, repeat
 from einops.layers.torch import Rearrange
 
 """
@@ -37,6 +37,32 @@ def unpack_one(t, ps, pattern):
     return unpack(t, ps, pattern)[0]
 
 
+def band_runs(dim_inputs):
+    """
+    Group consecutive bands of equal width.
+
+    :return: List of (number of bands, width) for each run of bands
+    """
+    runs = []
+    for dim_in in dim_inputs:
+        if len(runs) > 0 and runs[-1][1] == dim_in:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, dim_in])
+    return [tuple(run) for run in runs]
+
+
+def pack_parameters(parameters):
+    """
+    Stack parameters of equal shape into one tensor, and turn each parameter into a view of it, so that packed
+    weights do not take extra memory and loading from or saving to a state_dict keeps working.
+    """
+    packed = torch.stack([parameter.detach() for parameter in parameters])
+    for idx, parameter in enumerate(parameters):
+        parameter.data = packed[idx]
+    return packed
+
+
 # norm
 
 def l2norm(t):
@@ -221,17 +247,54 @@ class Transformer(Module):
         return self.norm(x)
 
 
+# band packing
+
+class PackedBands(Module):
+    """
+    Base class for modules running one small network per band.
+
+    In eval mode, the weights of consecutive bands of equal width are packed into batched tensors, so that each
+    run of bands is computed with one batched matmul instead of one kernel per band. Training and modules whose
+    linear layers have been replaced, e.g. by quantized ones, use the per-band networks.
+    """
+    def __init__(self, dim_inputs):
+        super().__init__()
+        self.dim_inputs = dim_inputs
+        self.packed = None
+        self.packing = True
+
+    def _apply(self, fn, *args, **kwargs):
+        # parameters are replaced when converting devices or dtypes, so they need to be packed again
+
+        self.packed = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def pack(self):
+        # pack outside of inference mode so that the parameters remain usable outside of it
+
+        with torch.inference_mode(False), torch.no_grad():
+            self.packed = self.pack_runs()
+
+    def forward(self, x):
+        if self.training or not self.packing:
+            return self.forward_bands(x)
+
+        if not exists(self.packed):
+            self.pack()
+
+        return self.forward_packed(x)
+
+
 # bandsplit module
 
-class BandSplit(Module):
+class BandSplit(PackedBands):
     @beartype
     def __init__(
             self,
             dim,
             dim_inputs: Tuple[int, ...]
     ):
-        super().__init__()
-        self.dim_inputs = dim_inputs
+        super().__init__(dim_inputs)
         self.to_features = ModuleList([])
 
         for dim_in in dim_inputs:
@@ -242,7 +305,35 @@ class BandSplit(Module):
 
             self.to_features.append(net)
 
-    def forward(self, x):
+    def pack_runs(self):
+        packed = []
+        start = 0
+
+        for count, dim_in in band_runs(self.dim_inputs):
+            nets = self.to_features[start:start + count]
+            start += count
+
+            gamma = pack_parameters([net[0].gamma for net in nets])
+            weight = pack_parameters([net[1].weight for net in nets])
+            bias = pack_parameters([net[1].bias for net in nets])
+            packed.append((count, dim_in, gamma, weight, bias))
+
+        return packed
+
+    def forward_packed(self, x):
+        outs = []
+        offset = 0
+
+        for count, dim_in, gamma, weight, bias in self.packed:
+            bands = x[..., offset:offset + count * dim_in].unflatten(-1, (count, dim_in))
+            offset += count * dim_in
+
+            bands = F.normalize(bands, dim=-1) * (dim_in ** 0.5) * gamma
+            outs.append(torch.einsum('...ki,koi->...ko', bands, weight) + bias)
+
+        return torch.cat(outs, dim=-2)
+
+    def forward_bands(self, x):
         x = x.split(self.dim_inputs, dim=-1)
 
         outs = []
@@ -278,7 +369,7 @@ def MLP(
     return nn.Sequential(*net)
 
 
-class MaskEstimator(Module):
+class MaskEstimator(PackedBands):
     @beartype
     def __init__(
             self,
@@ -287,8 +378,7 @@ class MaskEstimator(Module):
             depth,
             mlp_expansion_factor=4
     ):
-        super().__init__()
-        self.dim_inputs = dim_inputs
+        super().__init__(dim_inputs)
         self.to_freqs = ModuleList([])
         dim_hidden = dim * mlp_expansion_factor
 
@@ -302,7 +392,50 @@ class MaskEstimator(Module):
 
             self.to_freqs.append(mlp)
 
-    def forward(self, x):
+    def pack_runs(self):
+        packed = []
+        start = 0
+
+        for count, _ in band_runs(self.dim_inputs):
+            mlps = [mlp[0] for mlp in self.to_freqs[start:start + count]]
+            start += count
+
+            # linear layers are packed, activations are shared as they have no parameters
+
+            layers = []
+            for layer_idx, layer in enumerate(mlps[0]):
+                if isinstance(layer, nn.Linear):
+                    weight = pack_parameters([mlp[layer_idx].weight for mlp in mlps])
+                    bias = pack_parameters([mlp[layer_idx].bias for mlp in mlps])
+                    layers.append((weight, bias))
+                else:
+                    layers.append(layer)
+
+            packed.append((count, layers))
+
+        return packed
+
+    def forward_packed(self, x):
+        outs = []
+        start = 0
+
+        for count, layers in self.packed:
+            h = x[..., start:start + count, :]
+            start += count
+
+            for layer in layers:
+                if isinstance(layer, tuple):
+                    weight, bias = layer
+                    h = torch.einsum('...ki,koi->...ko', h, weight) + bias
+                else:
+                    h = layer(h)
+
+            h = F.glu(h, dim=-1)
+            outs.append(h.flatten(-2))
+
+        return torch.cat(outs, dim=-1)
+
+    def forward_bands(self, x):
         x = x.unbind(dim=-2)
 
         outs = []
@@ -432,6 +565,18 @@ class BSRoformer(Module):
 
             self.mask_estimators.append(mask_estimator)
 
+        # stem index of each mask estimator, as estimators may be dropped with prune_mask_estimators()
+
+        self.mask_estimator_stems = list(range(num_stems))
+
+        # optional compiled or traced version of encode(), see set_compiled_encoder()
+
+        self.compiled_encoder = None
+
+        # dtype of autocast for band split, transformers and mask estimators, see set_reduced_precision()
+
+        self.autocast_dtype = None
+
         # for the multi-resolution stft loss
 
         self.multi_stft_resolution_loss_weight = multi_stft_resolution_loss_weight
@@ -444,53 +589,155 @@ class BSRoformer(Module):
             normalized=multi_stft_normalized
         )
 
-    def forward(
-            self,
-            raw_audio,
-            target=None,
-            return_loss_breakdown=False
-    ):
+    def stft(self, raw_audio):
         """
-        einops
+        Compute the STFT of raw audio, merging audio channels into the frequency dimension.
 
-        b - batch
-        f - freq
-        t - time
-        s - audio channel (1 for mono, 2 for stereo)
-        n - number of 'stems'
-        c - complex (2)
-        d - feature dimension
+        :param raw_audio: Audio of shape (b, s, t), or (b, t) for mono. Mono audio passed to a stereo model is
+            treated as dual mono, with both channels identical
+        :return: Real tensor of shape (b, (f s), t, c)
         """
-
-        original_device = raw_audio.device
-        
-        x_is_mps = True if original_device.type == 'mps' else False
-        
-        if x_is_mps:
-            raw_audio = raw_audio.cpu()
-
-        device = raw_audio.device
-
         if raw_audio.ndim == 2:
             raw_audio = rearrange(raw_audio, 'b t -> b 1 t')
 
         channels = raw_audio.shape[1]
-        assert (not self.stereo and channels == 1) or (
-                    self.stereo and channels == 2), 'stereo needs to be set to True if passing in audio signal that is stereo (channel dimension of 2). also need to be False if mono (channel dimension of 1)'
-
-        # to stft
+        assert channels == 1 or (
+                    self.stereo and channels == 2), 'stereo needs to be set to True if passing in audio signal that is stereo (channel dimension of 2)'
 
         raw_audio, batch_audio_channel_packed_shape = pack_one(raw_audio, '* t')
 
-        stft_window = self.stft_window_fn(device=device)
+        stft_window = self.stft_window_fn(device=raw_audio.device)
 
         stft_repr = torch.stft(raw_audio, **self.stft_kwargs, window=stft_window, return_complex=True)
         stft_repr = torch.view_as_real(stft_repr)
 
         stft_repr = unpack_one(stft_repr, batch_audio_channel_packed_shape, '* f t c')
+        if channels < self.audio_channels:
+            # dual mono, the transform of the single channel is shared by both channels
+            stft_repr = repeat(stft_repr, 'b 1 f t c -> b s f t c', s=self.audio_channels)
         stft_repr = rearrange(stft_repr,
                               'b s f t c -> b (f s) t c')  # merge stereo / mono into the frequency, with frequency leading dimension, for band splitting
+        return stft_repr
+
+    def prune_mask_estimators(self, stems):
+        """
+        Drop the mask estimators of all stems not in stems, to save memory when only a subset of stems is needed.
+
+        :param stems: Indices of the stems to keep
+        """
+        keep = [idx for idx, stem in enumerate(self.mask_estimator_stems) if stem in stems]
+        self.mask_estimators = ModuleList([self.mask_estimators[idx] for idx in keep])
+        self.mask_estimator_stems = [self.mask_estimator_stems[idx] for idx in keep]
+
+    def estimate_masks(self, stft_repr, stem_groups=None, complement_groups=None):
+        """
+        Estimate complex masks of all stems from an STFT computed by stft().
+
+        Only the mask estimators of stems appearing in stem_groups are evaluated.
+
+        :param stft_repr: Real tensor of shape (b, (f s), t, c)
+        :param stem_groups: Optional list of lists of stem indices whose masks are summed into one mask per group
+        :param complement_groups: Optional positions in stem_groups of groups whose mask is that of the mixture
+            minus the stems in the group
+        :return: Real tensor of shape (b, n, (f s), t, c), with n the number of stems or groups
+        """
+        if exists(stem_groups):
+            stems = sorted(set(stem for group in stem_groups for stem in group))
+        else:
+            stems = self.mask_estimator_stems
+
+        missing_stems = set(stems) - set(self.mask_estimator_stems)
+        assert not missing_stems, f'mask estimators of stems {sorted(missing_stems)} have been pruned'
+
+        if len(stems) > 0:
+            mask = self.estimate_stem_masks(stft_repr, stems)
+        else:
+            mask = stft_repr.new_zeros((stft_repr.shape[0], 0, *stft_repr.shape[1:]))
+
+        if not exists(stem_groups):
+            return mask
+
+        # the iSTFT is linear, so merged stems can be formed by summing their masks
+
+        complement_groups = default(complement_groups, ())
+        group_masks = []
+
+        for idx, group in enumerate(stem_groups):
+            group_mask = mask[:, [stems.index(stem) for stem in group]].sum(dim=1)
+
+            # the mixture has a mask of 1 + 0j
+
+            if idx in complement_groups:
+                group_mask = -group_mask
+                group_mask[..., 0] += 1
+
+            group_masks.append(group_mask)
+
+        return torch.stack(group_masks, dim=1)
+
+    def quantize(self):
+        """
+        Apply dynamic int8 quantization to all linear layers in place, for CPU inference. Band modules then use
+        their per-band networks, as quantized layers cannot be packed.
+        """
+        torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        for module in self.modules():
+            if isinstance(module, PackedBands):
+                module.packed = None
+                module.packing = False
+
+    def set_reduced_precision(self, dtype=torch.bfloat16):
+        """
+        Hold weights in a reduced precision dtype and run the band split, transformers and mask estimators under
+        autocast. The STFT, rotary embeddings and the returned masks are kept in float32.
+
+        :param dtype: Reduced precision dtype, e.g. torch.bfloat16
+        """
+        self.to(dtype)
+
+        # rotation angles grow with the sequence position and lose too much precision in reduced precision
+
+        for module in self.modules():
+            if isinstance(module, RotaryEmbedding):
+                module.float()
+
+        self.autocast_dtype = dtype
+
+    def set_compiled_encoder(self, encoder):
+        """
+        Use a compiled or traced version of encode() for inference. The encoder is stored outside of the module
+        tree, so that it is not part of the state_dict and is not affected by device or dtype conversions.
+
+        :param encoder: Callable with the same signature as encode(), or None to use encode()
+        """
+        self.__dict__['compiled_encoder'] = encoder
+
+    def estimate_stem_masks(self, stft_repr, stems):
+        """
+        Estimate complex masks of the given stems from an STFT computed by stft().
+
+        :param stft_repr: Real tensor of shape (b, (f s), t, c)
+        :param stems: Indices of the stems, whose mask estimators must not have been pruned
+        :return: Real tensor of shape (b, n, (f s), t, c)
+        """
+        encode = default(self.compiled_encoder, self.encode)
+        mask_estimators = [self.mask_estimators[self.mask_estimator_stems.index(stem)] for stem in stems]
 
+        with torch.autocast(stft_repr.device.type, dtype=self.autocast_dtype, enabled=exists(self.autocast_dtype)):
+            x = encode(stft_repr)
+            mask = torch.stack([fn(x) for fn in mask_estimators], dim=1)
+
+        mask = rearrange(mask.float(), 'b n t (f c) -> b n f t c', c=2)
+        return mask
+
+    def encode(self, stft_repr):
+        """
+        Compute the band features shared by all mask estimators from an STFT computed by stft().
+
+        :param stft_repr: Real tensor of shape (b, (f s), t, c)
+        :return: Tensor of shape (b, t, bands, d)
+        """
         x = rearrange(stft_repr, 'b f t c -> b t (f c)')
 
         x = self.band_split(x)
@@ -522,15 +769,65 @@ class BSRoformer(Module):
             x, = unpack(x, ps, '* f d')
 
         x = self.final_norm(x)
+        return x
 
-        num_stems = len(self.mask_estimators)
+    def forward(
+            self,
+            raw_audio,
+            target=None,
+            return_loss_breakdown=False,
+            stem_groups=None,
+            complement_groups=None
+    ):
+        """
+        :param stem_groups: Optional list of lists of stem indices. If given, the masks of the stems in each group
+            are summed before the inverse STFT, and one output is returned per group instead of per stem
+        :param complement_groups: Optional positions in stem_groups of groups that are output as the mixture minus
+            the stems in the group
 
-        mask = torch.stack([fn(x) for fn in self.mask_estimators], dim=1)
-        mask = rearrange(mask, 'b n t (f c) -> b n f t c', c=2)
+        einops
+
+        b - batch
+        f - freq
+        t - time
+        s - audio channel (1 for mono, 2 for stereo)
+        n - number of 'stems'
+        c - complex (2)
+        d - feature dimension
+        """
+
+        original_device = raw_audio.device
+        
+        x_is_mps = True if original_device.type == 'mps' else False
+        
+        if x_is_mps:
+            raw_audio = raw_audio.cpu()
+
+        device = raw_audio.device
+
+        # to stft
+
+        stft_window = self.stft_window_fn(device=device)
+
+        stft_repr = self.stft(raw_audio)
+
+        # band split, axial / hierarchical attention and mask estimation
+
+        mask = self.estimate_masks(stft_repr, stem_groups, complement_groups)
+
+        num_stems = mask.shape[1]
         
         if x_is_mps:
             mask = mask.to('cpu')
 
+        # dual mono, the masks of both channels are averaged and a single channel is reconstructed
+
+        audio_channels = raw_audio.shape[1] if raw_audio.ndim == 3 else 1
+
+        if audio_channels < self.audio_channels:
+            mask = reduce(mask, 'b n (f s) t c -> b n f t c', 'mean', s=self.audio_channels)
+            stft_repr = rearrange(stft_repr, 'b (f s) t c -> b f s t c', s=self.audio_channels)[:, :, 0]
+
         # modulate frequency representation
 
         stft_repr = rearrange(stft_repr, 'b f t c -> b 1 f t c')
@@ -544,13 +841,13 @@ class BSRoformer(Module):
 
         # istft
 
-        stft_repr = rearrange(stft_repr, 'b n (f s) t -> (b n s) f t', s=self.audio_channels)
+        stft_repr = rearrange(stft_repr, 'b n (f s) t -> (b n s) f t', s=audio_channels)
 
         recon_audio = torch.istft(stft_repr, **self.stft_kwargs, window=stft_window, return_complex=False)
 
-        recon_audio = rearrange(recon_audio, '(b n s) t -> b n s t', s=self.audio_channels, n=num_stems)
+        recon_audio = rearrange(recon_audio, '(b n s) t -> b n s t', s=audio_channels, n=num_stems)
 
-        if num_stems == 1:
+        if num_stems == 1 and not exists(stem_groups):
             recon_audio = rearrange(recon_audio, 'b 1 s t -> b s t')
 
         # if a target is passed in, calculate loss for learning
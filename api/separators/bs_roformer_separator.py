@@ -1,19 +1,31 @@
-import gc
+import hashlib
 import subprocess
+import time
+from contextlib import ExitStack, nullcontext
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
 import torch.nn as nn
 import yaml
+from billiard import get_context
+from django.conf import settings
 from omegaconf import OmegaConf
 from spleeter.audio.adapter import AudioAdapter
 from tqdm import tqdm
 
 from api.models import OutputFormat
 from api.util import output_format_to_ext, is_output_format_lossy
+from .audio_stream import AudioStreamReader, AudioStreamWriter
 from .bs_roformer import BSRoformer
+from .chunking import crossfade_chunks
+from .inference_server import RemoteModel
+from .model_cache import model_cache
+from .model_compile import COMPILE_MODE_ONNX, compile_method, write_artifact
+from .segment_memo import SegmentMemo
+from .stem_cache import StemCache, mix_stems
 
 """
 This module defines a wrapper interface over the BS-RoFormer model for music source separation.
@@ -27,6 +39,12 @@ HF_REVISION = '370198fbb6997e3f5774778254698794e7b1267d'
 HF_MODEL_FILENAME = 'bs_roformer/bs_6stem_fixed.ckpt'
 HF_CONFIG_FILENAME = 'bs_roformer/bs_6stem_fixed_config.yaml'
 
+# Model weight dtypes of the supported precision modes
+PRECISIONS = {
+    'fp32': torch.float32,
+    'bf16': torch.bfloat16,
+}
+
 # Default paths for model files
 DEFAULT_MODEL_DIR = Path('pretrained_models/bs_roformer')
 DEFAULT_MODEL_PATH = DEFAULT_MODEL_DIR / 'bs_6stem_fixed.ckpt'
@@ -70,8 +88,9 @@ def try_download_model(model_dir: Path = DEFAULT_MODEL_DIR,
         )
 
 
+@lru_cache(maxsize=None)
 def load_config(config_path):
-    """Load YAML config with support for !!python/tuple tags."""
+    """Load YAML config with support for !!python/tuple tags. Configs are cached per path."""
     with open(config_path, 'r') as f:
         # Use UnsafeLoader to support !!python/tuple tags
         config = yaml.load(f, Loader=yaml.UnsafeLoader)
@@ -79,6 +98,54 @@ def load_config(config_path):
     return OmegaConf.create(config)
 
 
+def get_segments(mix: torch.Tensor, segment_length: int, step: int, total_length: int) -> torch.Tensor:
+    """
+    Return a strided view of all segments of a mix, zero-padding the mix to total_length.
+
+    :param mix: Audio tensor of shape (channels, samples)
+    :param segment_length: Length of each segment
+    :param step: Distance between the starts of consecutive segments
+    :param total_length: Length covered by all segments
+    :return: Tensor view of shape (segments, channels, segment_length)
+    """
+    mix = nn.functional.pad(mix, (0, total_length - mix.shape[-1]))
+    return mix.unfold(-1, segment_length, step).transpose(0, 1)
+
+
+def get_segment_levels(mix: torch.Tensor, segment_length: int, step: int, num_segments: int) -> torch.Tensor:
+    """
+    Return the RMS level in dBFS of each segment of a mix, measured over the audio it covers.
+
+    :param mix: Audio tensor of shape (channels, samples)
+    :param segment_length: Length of each segment
+    :param step: Distance between the starts of consecutive segments
+    :param num_segments: Number of segments, the last ones possibly extending past the end of the mix
+    :return: Tensor of shape (segments,)
+    """
+    energy = nn.functional.pad(mix.double().square().mean(0).cumsum(0), (1, 0))
+    starts = (torch.arange(num_segments) * step).clamp(max=mix.shape[-1])
+    ends = (starts + segment_length).clamp(max=mix.shape[-1])
+    power = (energy[ends] - energy[starts]) / (ends - starts).clamp(min=1)
+    return (10 * torch.log10(power.clamp(min=1e-20))).float()
+
+
+def overlap_add(frames: torch.Tensor, step: int) -> torch.Tensor:
+    """
+    Sum frames that start every `step` samples into a single signal.
+
+    :param frames: Tensor of shape (frames, ..., frame_length)
+    :param step: Distance between the starts of consecutive frames
+    :return: Tensor of shape (..., (frames - 1) * step + frame_length)
+    """
+    num_frames, frame_length = frames.shape[0], frames.shape[-1]
+    inner_shape = frames.shape[1:-1]
+    columns = frames.reshape(num_frames, -1, frame_length).permute(1, 2, 0).reshape(1, -1, num_frames)
+    output_length = (num_frames - 1) * step + frame_length
+    signal = nn.functional.fold(columns, output_size=(1, output_length), kernel_size=(1, frame_length),
+                                stride=(1, step))
+    return signal.reshape(*inner_shape, output_length)
+
+
 class BSRoformerSeparator:
     """Performs source separation using BS-RoFormer model."""
     
@@ -93,14 +160,52 @@ class BSRoformerSeparator:
     STEM_MODE_5_PIANO = '5stem_piano'    # bass, drums, other (incl guitar), vocals, piano
     STEM_MODE_6 = '6stem'           # bass, drums, other, vocals, guitar, piano
     
+    # Model stems merged into each output stem for every stem mode
+    STEM_GROUPS = {
+        STEM_MODE_4: {
+            'vocals': ['vocals'],
+            'drums': ['drums'],
+            'bass': ['bass'],
+            'other': ['other', 'guitar', 'piano'],
+        },
+        STEM_MODE_5_GUITAR: {
+            'vocals': ['vocals'],
+            'drums': ['drums'],
+            'bass': ['bass'],
+            'guitar': ['guitar'],
+            'other': ['other', 'piano'],
+        },
+        STEM_MODE_5_PIANO: {
+            'vocals': ['vocals'],
+            'drums': ['drums'],
+            'bass': ['bass'],
+            'piano': ['piano'],
+            'other': ['other', 'guitar'],
+        },
+        STEM_MODE_6: {name: [name] for name in STEM_NAMES},
+    }
+
+    # Constructor arguments of each preset, scaling the inference settings of the config. Segments keep the
+    # length the model was trained and compiled for, so presets only trade the number of segments per sample.
+    PRESETS = {
+        'draft': {'overlap_scale': 0.5},
+        'standard': {},
+        'max': {'overlap_scale': 2},
+    }
+    
     def __init__(self,
                  model_path=None,
                  config_path=None,
                  cpu_separation=False,  # Default to GPU as per user request
                  output_format=OutputFormat.MP3_256.value,
-                 batch_size=1,
-                 overlap=2,
-                 stem_mode='4stem'):
+                 batch_size=None,
+                 overlap=None,
+                 overlap_scale=1,
+                 stem_mode='4stem',
+                 quantize=False,
+                 precision=None,
+                 use_inference_server=True,
+                 stem_cache_dir=None):
         """
         Initialize BS-RoFormer separator.
         
@@ -108,18 +213,58 @@ class BSRoformerSeparator:
         :param config_path: Path to .yaml config file
         :param cpu_separation: Use CPU for inference (default: False for GPU)
         :param output_format: Output audio format
-        :param batch_size: Batch size for inference
-        :param overlap: Number of overlapping segments
+        :param batch_size: Batch size for inference, defaults to the batch size of the config
+        :param overlap: Number of segments overlapping each sample, defaults to the overlap of the config
+        :param overlap_scale: Factor applied to the overlap of the config if overlap is not given (at least 1 segment)
         :param stem_mode: Output stem configuration ('4stem', '5stem_guitar', '5stem_piano', '6stem')
+        :param quantize: Use a model with dynamic int8 quantization (CPU only)
+        :param precision: Precision mode ('fp32' or 'bf16'), defaults to the BS_ROFORMER_PRECISION setting
+        :param use_inference_server: Run the model on the inference server at INFERENCE_SERVER_ADDRESS, if set
+        :param stem_cache_dir: Directory to cache the raw stems of the source track in, if BS_ROFORMER_STEM_CACHE is set
         """
         self.model_path = Path(model_path) if model_path else DEFAULT_MODEL_PATH
         self.config_path = Path(config_path) if config_path else DEFAULT_CONFIG_PATH
         
         self.device = 'cpu' if cpu_separation else 'cuda'
+        precision = precision or settings.BS_ROFORMER_PRECISION
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision "{precision}", expected one of {list(PRECISIONS)}.')
+        self.precision = precision
+        # Weights are held in this dtype, while audio, STFT and overlap-add always use float32
+        self.dtype = PRECISIONS[precision]
         self.sample_rate = 44100
         self.batch_size = batch_size
         self.overlap = overlap
+        self.overlap_scale = overlap_scale
         self.stem_mode = stem_mode
+        self.quantize = quantize and cpu_separation
+        if quantize and not cpu_separation:
+            print('Int8 quantization is only supported for CPU separation, using the unquantized model instead')
+        if self.quantize and self.precision != 'fp32':
+            # Quantized models keep their remaining weights in float32, whatever the default precision
+            self.precision = 'fp32'
+            self.dtype = torch.float32
+        # Whether to decode, separate and encode incrementally instead of holding the whole track in memory
+        self.streaming = settings.BS_ROFORMER_STREAMING
+        # Whether to compute the STFT of the whole track once and overlap-add segments in the spectrogram domain
+        self.spectral = settings.BS_ROFORMER_SPECTRAL
+        # Whether to load models without the mask estimators of stems that are not needed
+        self.prune_stems = settings.BS_ROFORMER_PRUNE_STEMS
+        # How to compile the model for the segment shape ('trace', 'compile' or empty for eager mode)
+        self.compile_mode = settings.BS_ROFORMER_COMPILE
+        # RMS level in dBFS below which segments are not separated, or None to separate every segment
+        self.silence_threshold = settings.BS_ROFORMER_SILENCE_THRESHOLD
+        # Level in dB of the difference between channels, relative to the peak level, below which a track is
+        # separated as dual mono, or None to always separate both channels
+        self.dual_mono_threshold = settings.BS_ROFORMER_DUAL_MONO_THRESHOLD
+        # Number of segment outputs kept per job to be reused for bit-identical segments (0 to disable)
+        self.segment_memo_size = settings.BS_ROFORMER_SEGMENT_MEMO_SIZE
+        # Number of processes the segments of a track are sharded across for CPU separation
+        self.processes = settings.BS_ROFORMER_PROCESSES
+        # Whether to submit segments to the inference server shared by all workers of the host
+        self.use_inference_server = use_inference_server and bool(settings.INFERENCE_SERVER_ADDRESS)
+        # Directory of the raw stems of the source track, from which all outputs are derived, or None
+        self.stem_cache_dir = Path(stem_cache_dir) if stem_cache_dir and settings.BS_ROFORMER_STEM_CACHE else None
         
         # Output format settings
         self.audio_bitrate = f'{output_format}k' if is_output_format_lossy(output_format) else None
@@ -129,250 +274,734 @@ class BSRoformerSeparator:
         # Config will be loaded lazily in get_model after download
         self.config = None
         
-    def get_model(self):
-        """Load BS-RoFormer model from checkpoint."""
-        # Download model if not present
+    def get_model(self, groups: Optional[Dict[str, List[str]]] = None):
+        """
+        Get BS-RoFormer model, loading it from the checkpoint only if it is not already resident in the
+        process-wide model cache. All BS-RoFormer variants share the same cached instance, unless stem pruning
+        is enabled, in which case one instance is cached per set of required stems.
+
+        If an inference server is configured and running, a proxy running the model on the server is returned
+        instead, and the model is not loaded by this process.
+
+        :param groups: Outputs the model will be used for, to determine the required stems when pruning
+        """
+        self._load_config()
+
+        if self.use_inference_server:
+            try:
+                return RemoteModel(settings.INFERENCE_SERVER_ADDRESS, self.get_model_args())
+            except OSError as e:
+                print(f'Inference server unavailable, loading the model locally instead: {e}')
+
+        key = (str(self.model_path.resolve()), self.device, 'qint8' if self.quantize else str(self.dtype))
+        if not self.prune_stems or groups is None:
+            return model_cache.get(key, self.load_model)
+
+        stem_groups, _ = self._plan_groups(groups)
+        stems = tuple(sorted(set(stem for group in stem_groups for stem in group)))
+        return model_cache.get((*key, stems), lambda: self.load_model(stems))
+
+    def open_model(self, groups: Optional[Dict[str, List[str]]] = None):
+        """
+        Return a context manager yielding the model of get_model(), which closes the connection of a remote model
+        on exit. Local models stay resident in the model cache.
+
+        :param groups: Outputs the model will be used for, to determine the required stems when pruning
+        """
+        model = self.get_model(groups)
+        return model if isinstance(model, RemoteModel) else nullcontext(model)
+
+    def _load_config(self):
+        """Download the model if not present, and load its config if not already loaded."""
         try_download_model(DEFAULT_MODEL_DIR, self.model_path, self.config_path)
-        
-        # Load config if not already loaded
         if self.config is None:
             self.config = load_config(self.config_path)
-        
+
+    def get_model_args(self) -> Dict:
+        """Return the arguments with which the inference server creates a separator using the same model."""
+        return {
+            'model_path': str(self.model_path),
+            'config_path': str(self.config_path),
+            'quantize': self.quantize,
+            'precision': self.precision,
+        }
+
+    def load_model(self, stems: Optional[Tuple[int, ...]] = None):
+        """
+        Load BS-RoFormer model from checkpoint.
+
+        :param stems: Indices of the stems whose mask estimators are kept (default: all stems)
+        """
         # Convert config to dict and handle tuple conversion
         model_config = OmegaConf.to_container(self.config.model, resolve=True)
-        
+
         # Ensure freqs_per_bands is a tuple (OmegaConf may load as list)
         if 'freqs_per_bands' in model_config and isinstance(model_config['freqs_per_bands'], list):
             model_config['freqs_per_bands'] = tuple(model_config['freqs_per_bands'])
-        
+
         # Ensure multi_stft_resolutions_window_sizes is a tuple
         if 'multi_stft_resolutions_window_sizes' in model_config and isinstance(model_config['multi_stft_resolutions_window_sizes'], list):
             model_config['multi_stft_resolutions_window_sizes'] = tuple(model_config['multi_stft_resolutions_window_sizes'])
-        
+
         # Instantiate model from config
         model = BSRoformer(**model_config)
-        
+
         # Load checkpoint
-        checkpoint = torch.load(self.model_path, map_location='cpu')
-        model.load_state_dict(checkpoint)
-        model.to(self.device).eval()
-        
+        if self.quantize:
+            self._load_quantized_checkpoint(model)
+        else:
+            print(f'Loading BS-RoFormer model from {self.model_path}...')
+            checkpoint = torch.load(self.model_path, map_location='cpu')
+            model.load_state_dict(checkpoint)
+        if stems is not None:
+            model.prune_mask_estimators(stems)
+        if not self.quantize:
+            model.to(self.device)
+            if self.dtype != torch.float32:
+                model.set_reduced_precision(self.dtype)
+        model.eval()
+
+        if self.compile_mode:
+            self._compile_model(model)
+
         return model
+
+    def _load_quantized_checkpoint(self, model):
+        """
+        Quantize the model and load its int8 weights. The quantized weights are cached next to the checkpoint,
+        so that the fp32 checkpoint only needs to be loaded and quantized once.
+        """
+        # Quantized weight formats depend on the PyTorch version and quantization engine
+        quantized_name = f'{self.model_path.stem}.int8-{torch.__version__}-{torch.backends.quantized.engine}.pt'
+        quantized_path = self.model_path.with_name(quantized_name)
+        if quantized_path.is_file():
+            print(f'Loading quantized BS-RoFormer model from {quantized_path}...')
+            model.quantize()
+            # The file is written below by this worker, and contains packed quantized weights
+            model.load_state_dict(torch.load(quantized_path, map_location='cpu', weights_only=False))
+            return
+
+        print(f'Loading BS-RoFormer model from {self.model_path}...')
+        model.load_state_dict(torch.load(self.model_path, map_location='cpu'))
+        print(f'Quantizing BS-RoFormer model to {quantized_path}...')
+        model.quantize()
+        write_artifact(quantized_path, lambda tmp_path: torch.save(model.state_dict(), tmp_path))
+
+    def _compile_model(self, model):
+        """
+        Compile or trace the band split and transformer layers of the model for the segment shape and batch size
+        from the config. Falls back to eager mode if compilation fails.
+        """
+        C, _, batch_size = self._get_segment_params()
+        try:
+            with torch.no_grad():
+                example = model.stft(
+                    torch.zeros((batch_size, model.audio_channels, C), dtype=torch.float32, device=self.device))
+            # Compile under the same autocast as inference
+            with torch.autocast(example.device.type, dtype=model.autocast_dtype,
+                                enabled=model.autocast_dtype is not None):
+                model.set_compiled_encoder(
+                    compile_method(model, 'encode', example, self.compile_mode, self.model_path,
+                                   'qint8' if self.quantize else ''))
+        except Exception as e:
+            print(f'Failed to compile BS-RoFormer model, using eager mode instead: {e}')
+            model.set_compiled_encoder(None)
+
+    def warmup(self, load_model=True):
+        """
+        Download the model and optionally load it and run a dummy forward pass, so that the first separation
+        does not pay for allocator and kernel setup.
+
+        :param load_model: Whether to load the model and run a dummy forward pass
+        """
+        try_download_model(DEFAULT_MODEL_DIR, self.model_path, self.config_path)
+        if not load_model:
+            return
+
+        with self.open_model() as model, torch.inference_mode():
+            segment_length = self.config.model.stft_hop_length * (self.config.inference.dim_t - 1)
+            model(torch.zeros((1, 2, segment_length), dtype=torch.float32, device=self.device))
+
+    def _get_segment_params(self):
+        """Return the segment length, the step between segments and the batch size used for inference."""
+        segment_size = self.config.inference.dim_t
+        # Use model's stft_hop_length for segment calculation (not audio.hop_length)
+        hop_length = self.config.model.stft_hop_length
+        C = hop_length * (segment_size - 1)
+        N = self.overlap or max(1, int(self.config.inference.num_overlap * self.overlap_scale))
+        step = int(C // N)
+        batch_size = self.batch_size or self.config.inference.batch_size
+        return C, step, batch_size
+    
+    def _get_windows(self, C: int):
+        """Return the fade-in/out windows applied to the first, middle and last segments."""
+        device = self.device
+        fade_size = C // 10
+        fadein = torch.linspace(0, 1, fade_size).to(device)
+        fadeout = torch.linspace(1, 0, fade_size).to(device)
+        window_start = torch.ones(C).to(device)
+        window_middle = torch.ones(C).to(device)
+        window_finish = torch.ones(C).to(device)
+        window_start[-fade_size:] *= fadeout
+        window_finish[:fade_size] *= fadein
+        window_middle[:fade_size] *= fadein
+        window_middle[-fade_size:] *= fadeout
+        return window_start, window_middle, window_finish
+    
+    def _get_batch_windows(self, windows, first: int, last: int, num_segments: Optional[int]) -> torch.Tensor:
+        """
+        Return the windows of segments [first, last) as a tensor of shape (batch, C).
+
+        :param windows: Tuple of start, middle and finish windows
+        :param num_segments: Total number of segments, or None if not known yet
+        """
+        window_start, window_middle, window_finish = windows
+        batch_windows = window_middle.repeat(last - first, 1)
+        if first == 0:
+            batch_windows[0] = window_start
+        if last == num_segments and num_segments > 1:
+            batch_windows[-1] = window_finish
+        return batch_windows
     
-    def demix(self, mix: np.ndarray, model) -> Dict[str, np.ndarray]:
+    def demix(self, mix: np.ndarray, model, groups: Optional[Dict[str, List[str]]] = None) -> Dict[str, np.ndarray]:
         """
         Separate audio mixture into stems using BS-RoFormer.
         
         :param mix: Input audio as numpy array (channels, samples)
         :param model: Loaded BS-RoFormer model
-        :return: Dictionary mapping stem names to separated audio arrays
+        :param groups: Dict mapping output names to the model stems merged into them (default: every model stem)
+        :return: Dictionary mapping output names to separated audio arrays
         """
         device = self.device
+        groups = self._get_groups(groups)
+        stem_groups, complement_groups = self._plan_groups(groups)
         
         # Get inference parameters from config
-        segment_size = self.config.inference.dim_t
-        # Use model's stft_hop_length for segment calculation (not audio.hop_length)
-        hop_length = self.config.model.stft_hop_length
-        C = hop_length * (segment_size - 1)
-        N = self.config.inference.num_overlap
-        step = int(C // N)
-        fade_size = C // 10
-        batch_size = self.config.inference.batch_size
+        C, step, batch_size = self._get_segment_params()
+        # The spectral path needs the STFT of the model, which remote models do not expose, and a mix of at least
+        # one segment, as shorter ones cannot be reflect-padded and lose the context of a full segment
+        if (self.spectral and isinstance(model, BSRoformer) and step % model.stft_kwargs['hop_length'] == 0
+                and not model.stft_kwargs['normalized'] and mix.shape[-1] >= C):
+            return self.demix_spectral(mix, model, groups)
+        
+        # Both channels of dual mono tracks are separated at once, and duplicated back to stereo afterwards
+        dual_mono = self._is_dual_mono(mix)
+        if dual_mono:
+            print('Separating dual mono track as a single channel')
+            mix = mix[:1]
         
         # Convert to tensor
         mix_tensor = torch.tensor(mix, dtype=torch.float32)
-        length_init = mix_tensor.shape[-1]
+        channels, length_init = mix_tensor.shape
         
         # Padding for border effects
         if length_init > 2 * (C - step) and (C - step > 0):
             mix_tensor = nn.functional.pad(mix_tensor, (C - step, C - step), mode='reflect')
+        length = mix_tensor.shape[-1]
         
         # Set up windows for fade-in/out
-        fadein = torch.linspace(0, 1, fade_size).to(device)
-        fadeout = torch.linspace(1, 0, fade_size).to(device)
-        window_start = torch.ones(C).to(device)
-        window_middle = torch.ones(C).to(device)
-        window_finish = torch.ones(C).to(device)
-        window_start[-fade_size:] *= fadeout
-        window_finish[:fade_size] *= fadein
-        window_middle[:fade_size] *= fadein
-        window_middle[-fade_size:] *= fadeout
+        windows = self._get_windows(C)
         
-        # Number of stems
-        S = len(self.config.training.instruments)
+        # Number of outputs
+        S = len(groups)
         
-        # Calculate total number of segments for progress bar
-        total_segments = 0
-        pos = 0
-        while pos < mix_tensor.shape[1]:
-            total_segments += 1
-            pos += step
+        # Segments start every `step` samples, the last ones extending past the end of the mix
+        num_segments = (length + step - 1) // step
+        total_length = (num_segments - 1) * step + C
+        segments = get_segments(mix_tensor, C, step, total_length)
+        silent = self._get_silent_segments(mix_tensor, num_segments)
+        if silent is not None:
+            print(f'Skipping {int(silent.sum())} of {num_segments} segments as silent')
+        memo = self._get_segment_memo()
         
         with torch.inference_mode():
-            req_shape = (S,) + tuple(mix_tensor.shape)
-            result = torch.zeros(req_shape, dtype=torch.float32, device=device)
-            counter = torch.zeros(req_shape, dtype=torch.float32, device=device)
-            batch_data = []
-            batch_locations = []
+            result = torch.zeros((S, channels, total_length), dtype=torch.float32, device=device)
+            # Window weights are identical for all stems and channels, so only accumulate them over samples
+            envelope = torch.zeros(total_length, dtype=torch.float32, device=device)
             
-            i = 0
-            with tqdm(total=total_segments, desc='Separating', unit='segment', ncols=120) as pbar:
-                while i < mix_tensor.shape[1]:
-                    part = mix_tensor[:, i:i + C].to(device)
-                    length = part.shape[-1]
-                    if length < C:
-                        if length > C // 2 + 1:
-                            part = nn.functional.pad(part, (0, C - length), mode='reflect')
-                        else:
-                            part = nn.functional.pad(part, (0, C - length, 0, 0), mode='constant', value=0)
-                    
-                    batch_data.append(part)
-                    batch_locations.append((i, length))
-                    i += step
-                    
-                    # Process in batches
-                    if len(batch_data) >= batch_size or (i >= mix_tensor.shape[1]):
-                        arr = torch.stack(batch_data, dim=0)
-                        x = model(arr)
-                        
-                        for j in range(len(batch_locations)):
-                            start, l = batch_locations[j]
-                            window = window_middle
-                            if start == 0:
-                                window = window_start
-                            elif i >= mix_tensor.shape[1]:
-                                window = window_finish
-                            
-                            result[..., start:start + l] += x[j][..., :l] * window[..., :l]
-                            counter[..., start:start + l] += window[..., :l]
-                        
-                        # Update progress bar
-                        pbar.update(len(batch_data))
-                        batch_data = []
-                        batch_locations = []
+            with tqdm(total=num_segments, desc='Separating', unit='segment', ncols=120) as pbar:
+                args = (model, mix_tensor, segments, windows, num_segments, silent, memo, stem_groups,
+                        complement_groups, result, envelope)
+                num_processes = min(self.processes, num_segments // batch_size)
+                # Forked processes cannot share the connection of a remote model to the inference server
+                if (num_processes > 1 and device == 'cpu' and isinstance(model, BSRoformer)
+                        and self.compile_mode != COMPILE_MODE_ONNX):
+                    self._separate_sharded(*args, num_processes, pbar)
+                else:
+                    self._separate_segments(*args, 0, num_segments, pbar.update)
+                    if memo is not None:
+                        pbar.write(memo.get_stats())
             
-            # Normalize by overlap counter
-            estimated_sources = result / counter.clamp(min=1e-10)
+            # Normalize in place by the overlap envelope, broadcast over stems and channels
+            estimated_sources = result[..., :length]
+            estimated_sources /= envelope[:length].clamp(min=1e-10)
             
             # Remove padding
             if length_init > 2 * (C - step) and (C - step > 0):
                 estimated_sources = estimated_sources[..., (C - step):-(C - step)]
+            if dual_mono:
+                estimated_sources = estimated_sources.expand(-1, 2, -1)
         
-        # Convert to dict mapping stem names to numpy arrays
+        # Convert to dict mapping output names to numpy arrays
         sources = {}
-        instruments = self.config.training.instruments
-        for idx, name in enumerate(instruments):
+        for idx, name in enumerate(groups):
             sources[name] = estimated_sources[idx].cpu().numpy()
         
         return sources
     
-    def _combine_stems_for_4_output(self, sources: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    def _separate_segments(self, model, mix_tensor: torch.Tensor, segments: torch.Tensor, windows,
+                           num_segments: int, silent: Optional[torch.Tensor], memo: Optional[SegmentMemo],
+                           stem_groups: List[List[int]], complement_groups: List[int],
+                           result: torch.Tensor, envelope: torch.Tensor, first_segment: int, last_segment: int,
+                           update: Callable[[int], None], lock=None):
         """
-        Combine 6-stem output to 4-stem output by merging guitar and piano into other.
+        Separate segments [first_segment, last_segment) in batches, overlap-adding their windowed outputs into
+        result and the windows into envelope.
         
-        :param sources: Dictionary with 6 stems (bass, drums, other, vocals, guitar, piano)
-        :return: Dictionary with 4 stems (bass, drums, other, vocals)
+        :param silent: Boolean tensor marking the segments that are not separated, or None
+        :param memo: Outputs of previously separated segments, or None
+        :param update: Function called with the number of segments separated after each batch
+        :param lock: Lock held while adding into result and envelope, if they are shared with other processes
         """
-        result = {
-            'vocals': sources['vocals'],
-            'drums': sources['drums'],
-            'bass': sources['bass'],
-            # Combine other + guitar + piano into "other"
-            'other': sources['other'] + sources['guitar'] + sources['piano']
-        }
-        return result
+        C, step, batch_size = self._get_segment_params()
+        for first in range(first_segment, last_segment, batch_size):
+            last = min(first + batch_size, last_segment)
+            batch = self._get_segment_batch(mix_tensor, segments, first, last, C, step)
+            batch_silent = silent[first:last] if silent is not None else None
+            x = self._separate_batch(model, batch, batch_silent, memo, stem_groups, complement_groups)
+            batch_windows = self._get_batch_windows(windows, first, last, num_segments)
+            
+            # Overlap-add the whole batch at once
+            offset = first * step
+            span = (last - first - 1) * step + C
+            output = overlap_add(x * batch_windows[:, None, None], step)
+            weights = overlap_add(batch_windows, step)
+            with lock if lock is not None else nullcontext():
+                result[..., offset:offset + span] += output
+                envelope[offset:offset + span] += weights
+            
+            # Update progress bar
+            update(last - first)
     
-    def _combine_stems_for_5_output_guitar(self, sources: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    def _separate_sharded(self, model, mix_tensor: torch.Tensor, segments: torch.Tensor, windows, num_segments: int,
+                          silent: Optional[torch.Tensor], memo: Optional[SegmentMemo], stem_groups: List[List[int]],
+                          complement_groups: List[int], result: torch.Tensor, envelope: torch.Tensor,
+                          num_processes: int, pbar: tqdm):
         """
-        Combine 6-stem output to 5-stem output with guitar as separate stem (piano merged into other).
+        Separate all segments in forked processes, each running a contiguous shard of the segments with its share of
+        the threads, on copy-on-write views of the model and input. Outputs are overlap-added into result and
+        envelope through shared memory. Each process reuses segment outputs from its own copy of memo.
+        """
+        context = get_context('fork')
+        lock = context.Lock()
+        progress = context.Value('i', 0)
+        result.share_memory_()
+        envelope.share_memory_()
+        num_threads = max(1, torch.get_num_threads() // num_processes)
         
-        :param sources: Dictionary with 6 stems (bass, drums, other, vocals, guitar, piano)
-        :return: Dictionary with 5 stems (bass, drums, other, vocals, guitar)
+        def separate_shard(first_segment, last_segment):
+            torch.set_num_threads(num_threads)
+            
+            def update(count):
+                with progress.get_lock():
+                    progress.value += count
+            
+            with torch.inference_mode():
+                self._separate_segments(model, mix_tensor, segments, windows, num_segments, silent, memo,
+                                        stem_groups, complement_groups, result, envelope, first_segment,
+                                        last_segment, update, lock)
+            if memo is not None:
+                print(f'Segments {first_segment}-{last_segment}: {memo.get_stats()}')
+        
+        bounds = [idx * num_segments // num_processes for idx in range(num_processes + 1)]
+        processes = [
+            context.Process(target=separate_shard, args=(first, last)) for first, last in zip(bounds, bounds[1:])
+        ]
+        try:
+            for process in processes:
+                process.start()
+            while any(process.is_alive() for process in processes):
+                if any(process.exitcode for process in processes):
+                    break
+                time.sleep(0.5)
+                pbar.update(progress.value - pbar.n)
+        finally:
+            # Stop the remaining processes if the task was aborted or another process failed
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise RuntimeError('Separation process failed')
+        pbar.update(progress.value - pbar.n)
+    
+    def _is_dual_mono(self, mix: np.ndarray) -> bool:
+        """Return whether the channels of a stereo mix are identical within the dual mono threshold."""
+        if self.dual_mono_threshold is None or mix.shape[0] != 2:
+            return False
+        peak = np.abs(mix).max()
+        return np.abs(mix[0] - mix[1]).max() <= peak * 10**(self.dual_mono_threshold / 20)
+    
+    def _get_silent_segments(self, mix_tensor: torch.Tensor, num_segments: int) -> Optional[torch.Tensor]:
         """
-        result = {
-            'vocals': sources['vocals'],
-            'drums': sources['drums'],
-            'bass': sources['bass'],
-            'guitar': sources['guitar'],
-            # Combine other + piano into "other"
-            'other': sources['other'] + sources['piano']
-        }
-        return result
+        Return a boolean tensor marking the segments of a mix whose level is below the silence threshold, or None
+        if silence skipping is disabled.
+        """
+        if self.silence_threshold is None:
+            return None
+        C, step, _ = self._get_segment_params()
+        return get_segment_levels(mix_tensor, C, step, num_segments) < self.silence_threshold
+    
+    def _get_segment_memo(self) -> Optional[SegmentMemo]:
+        """Return an empty memo of segment outputs for a job, or None if memoization is disabled."""
+        return SegmentMemo(self.segment_memo_size) if self.segment_memo_size > 0 else None
     
-    def _combine_stems_for_5_output_piano(self, sources: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    def _separate_batch(self, model, batch: torch.Tensor, silent: Optional[torch.Tensor], memo: Optional[SegmentMemo],
+                        stem_groups: List[List[int]], complement_groups: List[int]) -> torch.Tensor:
         """
-        Combine 6-stem output to 5-stem output with piano as separate stem (guitar merged into other).
+        Separate a batch of segments, outputting silence for silent segments and reusing the outputs of
+        bit-identical segments from memo without running them through the model.
         
-        :param sources: Dictionary with 6 stems (bass, drums, other, vocals, guitar, piano)
-        :return: Dictionary with 5 stems (bass, drums, other, vocals, piano)
+        :param silent: Boolean tensor marking the silent segments of the batch, or None
+        :param memo: Outputs of previously separated segments, updated with the outputs of the batch, or None
+        :return: Tensor of shape (batch, outputs, channels, samples)
         """
-        result = {
-            'vocals': sources['vocals'],
-            'drums': sources['drums'],
-            'bass': sources['bass'],
-            'piano': sources['piano'],
-            # Combine other + guitar into "other"
-            'other': sources['other'] + sources['guitar']
-        }
-        return result
-    
-    def _get_output_stems(self, sources: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
-        """
-        Get output stems based on stem_mode.
-        
-        :param sources: Dictionary with 6 stems from model
-        :return: Dictionary with combined stems based on stem_mode
-        """
-        if self.stem_mode == self.STEM_MODE_4:
-            return self._combine_stems_for_4_output(sources)
-        elif self.stem_mode == self.STEM_MODE_5_GUITAR:
-            return self._combine_stems_for_5_output_guitar(sources)
-        elif self.stem_mode == self.STEM_MODE_5_PIANO:
-            return self._combine_stems_for_5_output_piano(sources)
-        elif self.stem_mode == self.STEM_MODE_6:
-            # Return all 6 stems without combining
-            return sources
-        else:
-            # Default to 4-stem
-            return self._combine_stems_for_4_output(sources)
+        if (silent is None or not silent.any()) and memo is None:
+            return model(batch.to(self.device), stem_groups=stem_groups, complement_groups=complement_groups)
+        
+        x = torch.zeros((batch.shape[0], len(stem_groups), *batch.shape[1:]), dtype=torch.float32, device=self.device)
+        pending = torch.ones(batch.shape[0], dtype=torch.bool) if silent is None else ~silent
+        if memo is not None:
+            keys = [memo.get_key(segment) for segment in batch]
+            for idx in pending.nonzero().flatten().tolist():
+                output = memo.get(keys[idx])
+                if output is not None:
+                    x[idx] = output
+                    pending[idx] = False
+        if not pending.any():
+            return x
+        
+        start = time.perf_counter()
+        x[pending] = model(batch[pending].to(self.device), stem_groups=stem_groups,
+                           complement_groups=complement_groups)
+        if memo is not None:
+            memo.compute_time += time.perf_counter() - start
+            for idx in pending.nonzero().flatten().tolist():
+                memo.put(keys[idx], x[idx].clone())
+        return x
     
-    def create_static_mix(self, parts: Dict[str, bool], input_path: str, output_path: Path):
+    def demix_spectral(self, mix: np.ndarray, model,
+                       groups: Optional[Dict[str, List[str]]] = None) -> Dict[str, np.ndarray]:
         """
-        Create a static mix by performing source separation and combining selected stems.
+        Separate audio mixture into stems using BS-RoFormer, computing the STFT of the whole track only once.
+
+        Segments are fed to the model as frame slices of the full-track STFT, and their masks are overlap-added
+        in the spectrogram domain before a single inverse STFT per stem. Frames at segment borders are computed
+        from the surrounding audio rather than from padded segments, so the output differs slightly from the
+        waveform overlap-add in demix().
+
+        :param mix: Input audio as numpy array (channels, samples)
+        :param model: Loaded BS-RoFormer model
+        :param groups: Dict mapping output names to the model stems merged into them (default: every model stem)
+        :return: Dictionary mapping output names to separated audio arrays
+        """
+        device = self.device
+        groups = self._get_groups(groups)
+        stem_groups, complement_groups = self._plan_groups(groups)
+        C, step, batch_size = self._get_segment_params()
+        n_fft = model.stft_kwargs['n_fft']
+        hop_length = model.stft_kwargs['hop_length']
+        segment_frames = C // hop_length + 1
+        step_frames = step // hop_length
         
-        :param parts: Dict mapping stem names to booleans indicating if they should be included
-        :param input_path: Path to source file
-        :param output_path: Path to output file
+        # Synthesis window, zero-padded to n_fft like torch.istft does
+        window = model.stft_window_fn(device=device)
+        window_offset = (n_fft - window.shape[-1]) // 2
+        window = nn.functional.pad(window, (window_offset, n_fft - window.shape[-1] - window_offset))
+        
+        mix_tensor = torch.tensor(mix, dtype=torch.float32)
+        channels, length_init = mix_tensor.shape
+        
+        # Padding for border effects
+        if length_init > 2 * (C - step) and (C - step > 0):
+            mix_tensor = nn.functional.pad(mix_tensor, (C - step, C - step), mode='reflect')
+        length = mix_tensor.shape[-1]
+        
+        # Windows over the frames of each segment
+        windows = self._get_windows(segment_frames)
+        
+        S = len(groups)
+        num_segments = (length + step - 1) // step
+        
+        with torch.inference_mode():
+            # Full-track STFT of shape ((f s), t, c), zero-padded to cover all segments
+            stft_repr = model.stft(mix_tensor[None].to(device))[0]
+            num_frames = stft_repr.shape[1]
+            total_frames = (num_segments - 1) * step_frames + segment_frames
+            stft_repr = nn.functional.pad(stft_repr, (0, 0, 0, max(0, total_frames - num_frames)))
+            segments = stft_repr.unfold(1, segment_frames, step_frames).permute(1, 0, 3, 2)
+            
+            result = torch.zeros((S, channels, (num_frames - 1) * hop_length + n_fft), dtype=torch.float32,
+                                 device=device)
+            window_envelope = torch.zeros(result.shape[-1], dtype=torch.float32, device=device)
+            # Masks of frames that can still be overlapped by upcoming segments
+            mask_sum = torch.zeros((S, stft_repr.shape[0], 2, 0), dtype=torch.float32, device=device)
+            mask_envelope = torch.zeros(0, dtype=torch.float32, device=device)
+            mask_start = 0
+            
+            with tqdm(total=num_segments, desc='Separating', unit='segment', ncols=120) as pbar:
+                for first in range(0, num_segments, batch_size):
+                    last = min(first + batch_size, num_segments)
+                    masks = model.estimate_masks(segments[first:last], stem_groups, complement_groups)
+                    batch_windows = self._get_batch_windows(windows, first, last, num_segments)
+                    
+                    # Overlap-add the masks over frames
+                    offset = first * step_frames - mask_start
+                    span = (last - first - 1) * step_frames + segment_frames
+                    extra = offset + span - mask_sum.shape[-1]
+                    mask_sum = torch.cat([mask_sum, mask_sum.new_zeros((*mask_sum.shape[:-1], extra))], dim=-1)
+                    mask_envelope = torch.cat([mask_envelope, mask_envelope.new_zeros(extra)])
+                    weighted_masks = masks * batch_windows[:, None, None, :, None]
+                    mask_sum[..., offset:offset + span] += overlap_add(weighted_masks.permute(0, 1, 2, 4, 3),
+                                                                       step_frames)
+                    mask_envelope[offset:offset + span] += overlap_add(batch_windows, step_frames)
+                    pbar.update(last - first)
+                    
+                    # Frames before the start of the next segment are final
+                    final = num_frames if last == num_segments else min(last * step_frames, num_frames)
+                    if final <= mask_start:
+                        continue
+                    count = final - mask_start
+                    mask = mask_sum[..., :count] / mask_envelope[:count].clamp(min=1e-10)
+                    mask = torch.view_as_complex(mask.permute(0, 1, 3, 2).contiguous())
+                    spec = torch.view_as_complex(stft_repr[:, mask_start:final].contiguous()) * mask
+                    
+                    # Inverse STFT of the final frames: (S, (f s), t) -> (t, S, s, n_fft)
+                    spec = spec.reshape(S, -1, channels, count).permute(3, 0, 2, 1)
+                    frames = torch.fft.irfft(spec, n=n_fft, dim=-1) * window
+                    position = mask_start * hop_length
+                    span = (count - 1) * hop_length + n_fft
+                    result[..., position:position + span] += overlap_add(frames, hop_length)
+                    window_envelope[position:position + span] += overlap_add(
+                        (window ** 2).expand(count, -1), hop_length)
+                    
+                    mask_sum = mask_sum[..., count:]
+                    mask_envelope = mask_envelope[count:]
+                    mask_start = final
+            
+            # Remove STFT centering, normalize by the squared window envelope and remove padding
+            center = n_fft // 2
+            estimated_sources = result[..., center:center + length]
+            estimated_sources /= window_envelope[center:center + length].clamp(min=1e-11)
+            if length_init > 2 * (C - step) and (C - step > 0):
+                estimated_sources = estimated_sources[..., (C - step):-(C - step)]
+        
+        sources = {}
+        for idx, name in enumerate(groups):
+            sources[name] = estimated_sources[idx].cpu().numpy()
+        
+        return sources
+    
+    def demix_stream(self, reader: AudioStreamReader, model, write: Callable[[Dict[str, np.ndarray]], None],
+                     groups: Optional[Dict[str, List[str]]] = None):
         """
-        input_path = Path(input_path)
-        model = self.get_model()
+        Separate an audio stream into stems using BS-RoFormer with memory bounded by the segment and batch size.
+
+        Input is decoded in windows, and each region of the output is passed to write() as soon as no later
+        segment can overlap it. The output is identical to that of demix().
+
+        :param reader: Stereo audio stream
+        :param model: Loaded BS-RoFormer model
+        :param write: Function called with dicts mapping output names to consecutive audio chunks (channels, samples)
+        :param groups: Dict mapping output names to the model stems merged into them (default: every model stem)
+        """
+        device = self.device
+        groups = self._get_groups(groups)
+        stem_groups, complement_groups = self._plan_groups(groups)
+        C, step, batch_size = self._get_segment_params()
+        border = C - step
+        windows = self._get_windows(C)
+        
+        # Tracks too short to be padded like in demix() are separated in memory
+        mix = reader.read(max(2 * border + 1, (batch_size - 1) * step + C))
+        if reader.eof:
+            write(self.demix(mix, model, groups))
+            return
+        
+        # Input buffer, starting with the reflect padding of the start of the track
+        buffer = torch.tensor(mix, dtype=torch.float32)
+        buffer = torch.cat([buffer[:, 1:border + 1].flip(-1), buffer], dim=-1)
+        channels = buffer.shape[0]
+        # Positions below are relative to the start of the padded track
+        buffer_start = 0
+        # Padded length of the track, known once the stream is exhausted
+        length = None
+        num_segments = None
+        result = torch.zeros((len(groups), channels, 0), dtype=torch.float32, device=device)
+        envelope = torch.zeros(0, dtype=torch.float32, device=device)
+        result_start = 0
+        written = border
+        first = 0
+        num_silent = 0
+        memo = self._get_segment_memo()
         
-        # Load audio
-        waveform, _ = self.audio_adapter.load(str(input_path), sample_rate=self.sample_rate)
+        with torch.inference_mode(), tqdm(desc='Separating', unit='segment', ncols=120) as pbar:
+            while True:
+                # Read until the next batch of segments is fully buffered or the stream ends
+                batch_end = (first + batch_size - 1) * step + C
+                while length is None and buffer_start + buffer.shape[-1] < batch_end:
+                    chunk = reader.read(batch_end - buffer_start - buffer.shape[-1])
+                    buffer = torch.cat([buffer, torch.tensor(chunk, dtype=torch.float32)], dim=-1)
+                    if reader.eof:
+                        # Reflect padding of the end of the track
+                        buffer = torch.cat([buffer, buffer[:, buffer.shape[-1] - border - 1:-1].flip(-1)], dim=-1)
+                        length = buffer_start + buffer.shape[-1]
+                        num_segments = (length + step - 1) // step
+                if num_segments is not None and first >= num_segments:
+                    break
+                
+                last = first + batch_size if num_segments is None else min(first + batch_size, num_segments)
+                mix_view = buffer[:, first * step - buffer_start:]
+                segments = get_segments(mix_view, C, step, (last - first - 1) * step + C)
+                batch = self._get_segment_batch(mix_view, segments, 0, last - first, C, step)
+                silent = self._get_silent_segments(mix_view, last - first)
+                if silent is not None:
+                    num_silent += int(silent.sum())
+                x = self._separate_batch(model, batch, silent, memo, stem_groups, complement_groups)
+                batch_windows = self._get_batch_windows(windows, first, last, num_segments)
+                
+                # Extend the output buffers to cover the batch, then overlap-add it
+                offset = first * step - result_start
+                span = (last - first - 1) * step + C
+                extra = offset + span - result.shape[-1]
+                result = torch.cat([result, result.new_zeros((*result.shape[:-1], extra))], dim=-1)
+                envelope = torch.cat([envelope, envelope.new_zeros(extra)])
+                result[..., offset:offset + span] += overlap_add(x * batch_windows[:, None, None], step)
+                envelope[offset:offset + span] += overlap_add(batch_windows, step)
+                first = last
+                pbar.update(x.shape[0])
+                
+                # Output before the start of the next segment is final, except for the end padding
+                final = length if num_segments is not None and first >= num_segments else first * step
+                write_end = final if length is None else min(final, length - border)
+                if write_end > written:
+                    region = result[..., written - result_start:write_end - result_start]
+                    region = region / envelope[written - result_start:write_end - result_start].clamp(min=1e-10)
+                    write({name: region[idx].cpu().numpy() for idx, name in enumerate(groups)})
+                    written = write_end
+                result = result[..., final - result_start:]
+                envelope = envelope[final - result_start:]
+                result_start = final
+                
+                # Drop input that is no longer needed, keeping enough to reflect the end of the track
+                keep = max(buffer_start, min(first * step, buffer_start + buffer.shape[-1] - border - 1))
+                buffer = buffer[:, keep - buffer_start:]
+                buffer_start = keep
         
-        # Convert to (channels, samples) format for model
-        # AudioAdapter returns (samples, channels)
-        mix = waveform.T
+        if self.silence_threshold is not None:
+            print(f'Skipped {num_silent} of {first} segments as silent')
+        if memo is not None:
+            print(memo.get_stats())
+    
+    def _get_segment_batch(self, mix_tensor: torch.Tensor, segments: torch.Tensor, first: int, last: int,
+                           C: int, step: int) -> torch.Tensor:
+        """
+        Materialize segments [first, last) as a batch of shape (batch, channels, C).
+
+        Segments that run past the end of the mix are zero-padded, unless more than half of the segment
+        contains audio, in which case the audio is reflected instead.
+        """
+        batch = segments[first:last].clone()
+        length = mix_tensor.shape[-1]
+        for idx in range(first, last):
+            start = idx * step
+            remaining = length - start
+            if C // 2 + 1 < remaining < C:
+                batch[idx - first] = nn.functional.pad(mix_tensor[:, start:], (0, C - remaining), mode='reflect')
+        return batch
+    
+    def _get_output_groups(self) -> Dict[str, List[str]]:
+        """Return the model stems merged into each output stem based on stem_mode (4-stem by default)."""
+        return self.STEM_GROUPS.get(self.stem_mode, self.STEM_GROUPS[self.STEM_MODE_4])
+    
+    def _get_mix_groups(self, parts: Dict[str, bool]) -> Dict[str, List[str]]:
+        """
+        Return a single 'mix' output merging the model stems of all output stems selected in parts.
         
-        # Separate into 6 stems
-        sources_6 = self.demix(mix, model)
+        :param parts: Dict mapping stem names to booleans indicating if they should be included
+        """
+        output_groups = self._get_output_groups()
+        stems = [
+            stem for stem_name, include in parts.items() if include and stem_name in output_groups
+            for stem in output_groups[stem_name]
+        ]
+        return {'mix': stems}
+    
+    def _get_groups(self, groups: Optional[Dict[str, List[str]]]) -> Dict[str, List[str]]:
+        """Return groups, or one group per model stem if groups is None."""
+        if groups is None:
+            return {name: [name] for name in self.config.training.instruments}
+        return groups
+    
+    def _plan_groups(self, groups: Dict[str, List[str]]) -> Tuple[List[List[int]], List[int]]:
+        """
+        Convert groups of model stem names into groups of model stem indices.
         
-        # Get output stems based on stem_mode
-        output_sources = self._get_output_stems(sources_6)
+        A group that keeps more stems than it excludes is computed as the mixture minus the excluded stems,
+        which requires fewer mask estimators to be evaluated.
         
-        # Free GPU memory
-        del model
-        torch.cuda.empty_cache()
-        gc.collect()
+        :param groups: Dict mapping output names to the model stems merged into them
+        :return: Tuple of the stem index groups and the positions of groups that are mixture complements
+        """
+        instruments = list(self.config.training.instruments)
+        stem_groups = []
+        complement_groups = []
+        for idx, stems in enumerate(groups.values()):
+            kept = [instruments.index(stem) for stem in stems]
+            excluded = [stem for stem in range(len(instruments)) if stem not in kept]
+            if len(excluded) < len(kept):
+                stem_groups.append(excluded)
+                complement_groups.append(idx)
+            else:
+                stem_groups.append(kept)
+        return stem_groups, complement_groups
+    
+    def create_static_mix(self, parts: Dict[str, bool], input_path: str, output_path: Path, offset: float = 0.,
+                          duration: Optional[float] = None):
+        """
+        Create a static mix by performing source separation and combining selected stems.
         
-        # Combine selected parts
-        final_source = None
-        for stem_name, include in parts.items():
-            if not include:
-                continue
-            if stem_name in output_sources:
-                source = output_sources[stem_name]
-                final_source = source if final_source is None else final_source + source
+        :param parts: Dict mapping stem names to booleans indicating if they should be included
+        :param input_path: Path to source file
+        :param output_path: Path to output file
+        :param offset: Time in seconds of the source file to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
+        """
+        input_path = Path(input_path)
+        # Selected stems are merged into a single output before the inverse STFT
+        groups = self._get_mix_groups(parts)
+        stem_cache = self.get_stem_cache(offset, duration)
+        if stem_cache is not None:
+            self._export_from_stem_cache(stem_cache, input_path, offset, duration, groups, {'mix': output_path})
+            return
+        with self.open_model(groups) as model:
+            if self.streaming:
+                print(f'Separating and exporting to {output_path}...')
+                with AudioStreamReader(str(input_path), self.sample_rate, offset=offset, duration=duration) as reader, \
+                        AudioStreamWriter(output_path, self.sample_rate, 2, self.audio_format, self.audio_bitrate) as writer:
+                    self.demix_stream(reader, model, lambda sources: writer.write(sources['mix']), groups)
+                return
+            
+            # Load audio
+            waveform, _ = self.audio_adapter.load(str(input_path), offset=offset, duration=duration,
+                                                  sample_rate=self.sample_rate)
+            
+            # Convert to (channels, samples) format for model
+            # AudioAdapter returns (samples, channels)
+            mix = waveform.T
+            
+            # Separate into the combined selected parts
+            final_source = self.demix(mix, model, groups)['mix']
         
         # Convert back to (samples, channels) for saving
         final_source = final_source.T
@@ -381,34 +1010,55 @@ class BSRoformerSeparator:
         self.audio_adapter.save(str(output_path), final_source, self.sample_rate,
                                 self.audio_format, self.audio_bitrate)
     
-    def separate_into_parts(self, input_path: str, output_path: str):
+    def separate_into_parts(self, input_path: str, output_path: str, offset: float = 0.,
+                            duration: Optional[float] = None):
         """
         Separate audio into individual stem files.
         
         :param input_path: Input audio file path
         :param output_path: Output directory path
+        :param offset: Time in seconds of the input to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
         """
         input_path = Path(input_path)
         output_path = Path(output_path)
         
-        model = self.get_model()
-        
-        # Load audio
-        waveform, _ = self.audio_adapter.load(str(input_path), sample_rate=self.sample_rate)
-        
-        # Convert to (channels, samples) format for model
-        mix = waveform.T
-        
-        # Separate into 6 stems
-        sources_6 = self.demix(mix, model)
-        
-        # Get output stems based on stem_mode
-        output_sources = self._get_output_stems(sources_6)
-        
-        # Free GPU memory
-        del model
-        torch.cuda.empty_cache()
-        gc.collect()
+        # Output stems based on stem_mode
+        groups = self._get_output_groups()
+        stem_cache = self.get_stem_cache(offset, duration)
+        if stem_cache is not None:
+            output_paths = {name: output_path / f'{name}.{self.audio_format}' for name in groups}
+            self._export_from_stem_cache(stem_cache, input_path, offset, duration, groups, output_paths)
+            return
+        with self.open_model(groups) as model:
+            if self.streaming:
+                with ExitStack() as stack, \
+                        AudioStreamReader(str(input_path), self.sample_rate, offset=offset, duration=duration) as reader:
+                    # Encoders are started once the first region of each output stem is available
+                    writers = {}
+                    
+                    def write(sources):
+                        for stem_name, source in sources.items():
+                            if stem_name not in writers:
+                                filename = f'{stem_name}.{self.audio_format}'
+                                print(f'Exporting {filename}...')
+                                writers[stem_name] = stack.enter_context(
+                                    AudioStreamWriter(output_path / filename, self.sample_rate, 2, self.audio_format,
+                                                      self.audio_bitrate))
+                            writers[stem_name].write(source)
+                    
+                    self.demix_stream(reader, model, write, groups)
+                return
+            
+            # Load audio
+            waveform, _ = self.audio_adapter.load(str(input_path), offset=offset, duration=duration,
+                                                  sample_rate=self.sample_rate)
+            
+            # Convert to (channels, samples) format for model
+            mix = waveform.T
+            
+            # Separate into output stems
+            output_sources = self.demix(mix, model, groups)
         
         # Export all stems
         for stem_name, source in output_sources.items():
@@ -420,3 +1070,118 @@ class BSRoformerSeparator:
             print(f'Exporting {filename}...')
             self.audio_adapter.save(str(stem_path), source_transposed, self.sample_rate,
                                     self.audio_format, self.audio_bitrate)
+    
+    def get_stem_cache(self, offset: float = 0., duration: Optional[float] = None) -> Optional[StemCache]:
+        """
+        Return the cache of the raw stems separated from a time range of the source track, or None if stem caching
+        is disabled. Stems are cached separately for every setting that changes them.
+        
+        :param offset: Time in seconds of the source file the range starts at
+        :param duration: Duration in seconds of the range, or None until the end
+        """
+        if self.stem_cache_dir is None:
+            return None
+        self._load_config()
+        C, step, _ = self._get_segment_params()
+        key = (self.model_path.name, self.quantize, self.precision, C, step, self.spectral, self.silence_threshold,
+               self.dual_mono_threshold, offset, duration)
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        return StemCache(self.stem_cache_dir / f'bs_roformer-{digest}', list(self.config.training.instruments),
+                         self.sample_rate)
+    
+    def _cache_stems(self, stem_cache: StemCache, input_path: Path, offset: float, duration: Optional[float]):
+        """Separate a time range of the source track into every model stem and cache them."""
+        # Every stem is needed, so every mask estimator is evaluated
+        print(f'Caching stems to {stem_cache.directory}...')
+        with self.open_model(None) as model, stem_cache.open_writer() as write:
+            if self.streaming:
+                with AudioStreamReader(str(input_path), self.sample_rate, offset=offset, duration=duration) as reader:
+                    self.demix_stream(reader, model, write)
+                return
+            waveform, _ = self.audio_adapter.load(str(input_path), offset=offset, duration=duration,
+                                                  sample_rate=self.sample_rate)
+            write(self.demix(waveform.T, model))
+    
+    def _export_from_stem_cache(self, stem_cache: StemCache, input_path: Path, offset: float,
+                                duration: Optional[float], groups: Dict[str, List[str]], output_paths: Dict[str, str]):
+        """
+        Export outputs mixed from the cached raw stems of a time range of the source track, separating and caching
+        the stems first if they are not cached yet. Outputs match those of the model for the same groups.
+        
+        :param groups: Dict mapping output names to the model stems merged into them
+        :param output_paths: Dict mapping output names to output file paths
+        """
+        if stem_cache.exists():
+            print(f'Using cached stems from {stem_cache.directory}')
+        else:
+            self._cache_stems(stem_cache, input_path, offset, duration)
+        
+        # Groups computed by the model as the mixture minus excluded stems are mixed the same way
+        _, complement_groups = self._plan_groups(groups)
+        complements = [name for idx, name in enumerate(groups) if idx in complement_groups]
+        with ExitStack() as stack, \
+                AudioStreamReader(str(input_path), self.sample_rate, offset=offset, duration=duration) as reader:
+            writers = {
+                name: stack.enter_context(
+                    AudioStreamWriter(path, self.sample_rate, 2, self.audio_format, self.audio_bitrate))
+                for name, path in output_paths.items()
+            }
+            print(f'Mixing {len(output_paths)} outputs from cached stems...')
+            for mix, stems in stem_cache.read(reader, self.sample_rate * 30):
+                for name, output in mix_stems(mix, stems, groups, complements).items():
+                    writers[name].write(output)
+    
+    def separate_chunk(self, input_path: str, chunk_dir: str, start: int, length: Optional[int],
+                       parts: Optional[Dict[str, bool]] = None, offset: float = 0.,
+                       duration: Optional[float] = None):
+        """
+        Separate a time range of a track, saving each output as a .npy file in chunk_dir for stitch_chunks().
+        
+        :param input_path: Path or URL of the source file
+        :param chunk_dir: Directory to save the outputs to
+        :param start: First sample of the range, relative to offset
+        :param length: Number of samples of the range, or None to separate until the end of the track
+        :param parts: Stems to combine into a single 'mix' output, or None to output each stem of stem_mode
+        :param offset: Time in seconds of the part of the track being chunked, which all chunks decode from
+        :param duration: Duration in seconds of the part of the track being chunked, or None until the end
+        """
+        groups = self._get_output_groups() if parts is None else self._get_mix_groups(parts)
+        with self.open_model(groups) as model:
+            # Decode from the same offset for every chunk, so that chunk boundaries are sample-accurate
+            with AudioStreamReader(str(input_path), self.sample_rate, offset=offset, duration=duration) as reader:
+                reader.skip(start)
+                if length is not None:
+                    mix = reader.read(length)
+                else:
+                    chunks = []
+                    while not reader.eof:
+                        chunks.append(reader.read(self.sample_rate * 60))
+                    mix = np.concatenate(chunks, axis=-1)
+            
+            sources = self.demix(mix, model, groups)
+        chunk_dir = Path(chunk_dir)
+        chunk_dir.mkdir(parents=True, exist_ok=True)
+        for name, source in sources.items():
+            np.save(chunk_dir / f'{name}.npy', source)
+    
+    def stitch_chunks(self, chunk_dirs: List[str], overlap: int, output_paths: Dict[str, str]):
+        """
+        Crossfade the outputs of separate_chunk() for consecutive chunks of a track and export them.
+        
+        :param chunk_dirs: Directories of the separated chunks, in order
+        :param overlap: Number of samples shared by consecutive chunks
+        :param output_paths: Dict mapping output names to output file paths
+        """
+        # Chunks are loaded one at a time
+        chunks = ({name: np.load(Path(chunk_dir) / f'{name}.npy') for name in output_paths}
+                  for chunk_dir in chunk_dirs)
+        with ExitStack() as stack:
+            writers = {
+                name: stack.enter_context(
+                    AudioStreamWriter(path, self.sample_rate, 2, self.audio_format, self.audio_bitrate))
+                for name, path in output_paths.items()
+            }
+            print(f'Stitching {len(chunk_dirs)} chunks...')
+            for region in crossfade_chunks(chunks, overlap):
+                for name, source in region.items():
+                    writers[name].write(source)
@@ -0,0 +1,50 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+"""
+This module defines how long tracks are split into overlapping chunks that are separated independently, and how
+the separated chunks are crossfaded back into a single track.
+"""
+
+
+def plan_chunks(length: int, chunk_length: int, overlap: int) -> List[Tuple[int, Optional[int]]]:
+    """
+    Split a track into chunks overlapping by `overlap` samples.
+
+    :param length: Length of the track in samples, which may be approximate
+    :param chunk_length: Length of each chunk in samples, greater than overlap
+    :param overlap: Number of samples shared by consecutive chunks
+    :return: List of (start, length) of each chunk, the length of the last chunk being None to read until the end
+    """
+    step = chunk_length - overlap
+    starts = list(range(0, max(length - overlap, 1), step))
+    return [(start, chunk_length) for start in starts[:-1]] + [(starts[-1], None)]
+
+
+def crossfade_chunks(chunks: Iterable[Dict[str, np.ndarray]], overlap: int) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Stitch consecutive chunks overlapping by `overlap` samples, linearly crossfading their overlapping regions.
+
+    :param chunks: Separated chunks, as dicts mapping output names to arrays of shape (channels, samples)
+    :param overlap: Number of samples shared by consecutive chunks
+    :return: Consecutive regions of the stitched outputs, as dicts mapping output names to arrays
+    """
+    tail = None
+    for chunk in chunks:
+        length = next(iter(chunk.values())).shape[-1]
+        fade_length = 0 if tail is None else min(overlap, next(iter(tail.values())).shape[-1], length)
+        # Kept until the next chunk, unless this is the last one
+        keep = max(fade_length, length - overlap)
+        region = {}
+        for name, source in chunk.items():
+            if fade_length > 0:
+                fade = ((np.arange(fade_length, dtype=np.float32) + 0.5) / fade_length)
+                faded = tail[name][..., :fade_length] * (1 - fade) + source[..., :fade_length] * fade
+                region[name] = np.concatenate([faded, source[..., fade_length:keep]], axis=-1)
+            else:
+                region[name] = source[..., :keep]
+        tail = {name: source[..., keep:] for name, source in chunk.items()}
+        yield region
+    if tail is not None:
+        yield tail
@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+from typing import List, Set
+
+import torch
+
+"""
+This module defines how the CPU cores of a machine are partitioned among separation worker processes, so that
+concurrent workers neither oversubscribe cores nor access memory across NUMA nodes.
+"""
+
+NUMA_NODE_DIR = Path('/sys/devices/system/node')
+
+# Environment variables read by the BLAS and OpenMP thread pools of processes spawned by a worker
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def parse_cpu_list(cpu_list: str) -> Set[int]:
+    """Parse a Linux CPU list such as '0-3,8-11' into a set of CPU ids."""
+    cpus = set()
+    for part in cpu_list.strip().split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def get_numa_nodes() -> List[List[int]]:
+    """
+    Return the CPUs this process may run on, grouped by NUMA node. Machines without NUMA information are
+    treated as a single node.
+    """
+    available = os.sched_getaffinity(0)
+    nodes = []
+    for node_dir in sorted(NUMA_NODE_DIR.glob('node[0-9]*'), key=lambda path: int(path.name[4:])):
+        try:
+            cpus = parse_cpu_list((node_dir / 'cpulist').read_text()) & available
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(sorted(cpus))
+    return nodes or [sorted(available)]
+
+
+def partition_cpus(nodes: List[List[int]], num_workers: int, index: int) -> List[int]:
+    """
+    Return the CPUs assigned to the worker with the given index.
+
+    With at least as many workers as NUMA nodes, workers are spread evenly across nodes and the CPUs of each node
+    are split among the workers on it, so no worker spans two nodes. With fewer workers than nodes, each worker
+    gets a contiguous group of whole nodes.
+
+    :param nodes: CPUs grouped by NUMA node
+    :param num_workers: Number of worker processes
+    :param index: Index of the worker, between 0 and num_workers - 1
+    """
+    index %= num_workers
+    if num_workers < len(nodes):
+        start, end = index * len(nodes) // num_workers, (index + 1) * len(nodes) // num_workers
+        return [cpu for node in nodes[start:end] for cpu in node]
+
+    node_index = index * len(nodes) // num_workers
+    node_workers = [i for i in range(num_workers) if i * len(nodes) // num_workers == node_index]
+    cpus = nodes[node_index]
+    position = node_workers.index(index)
+    start, end = position * len(cpus) // len(node_workers), (position + 1) * len(cpus) // len(node_workers)
+    # A node with fewer CPUs than workers is shared by some of them
+    return cpus[start:end] or [cpus[position % len(cpus)]]
+
+
+def set_num_threads(num_threads: int):
+    """Size the PyTorch, TensorFlow and BLAS thread pools of this process."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(num_threads)
+
+    torch.set_num_threads(num_threads)
+    try:
+        # Separation runs one model at a time, so operators are parallelized internally only
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # The inter-op pool was already started by the parent process
+        pass
+
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except (ImportError, RuntimeError):
+        # TensorFlow is not installed, or its runtime was already initialized by the parent process
+        pass
+
+
+def pin_worker_process(index: int, num_workers: int) -> List[int]:
+    """
+    Pin this worker process to its share of the CPUs and size its thread pools to match.
+
+    :param index: Index of the worker process, between 0 and num_workers - 1
+    :param num_workers: Number of worker processes sharing the machine
+    :return: CPUs the process was pinned to
+    """
+    cpus = partition_cpus(get_numa_nodes(), num_workers, index)
+    os.sched_setaffinity(0, cpus)
+    set_num_threads(len(cpus))
+    return cpus
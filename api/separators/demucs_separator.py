@@ -1,17 +1,21 @@
 import gc
 from pathlib import Path
+from urllib.parse import urlparse
 
 import torch
+import yaml
 
 from billiard.exceptions import SoftTimeLimitExceeded
 from billiard.pool import Pool
-from demucs.pretrained import get_model, ModelLoadingError
+from demucs.audio import AudioFile
+from demucs.pretrained import get_model, ModelLoadingError, REMOTE_ROOT, _parse_remote_files
 from demucs.separate import *
 from django.conf import settings
 from spleeter.audio.adapter import AudioAdapter
 from api.models import OutputFormat
 
 from api.util import output_format_to_ext, is_output_format_lossy
+from .model_cache import model_cache
 
 """
 This module defines a wrapper interface over the Demucs API.
@@ -20,19 +24,28 @@ Code adapted from https://github.com/facebookresearch/demucs/blob/main/demucs/se
 
 class DemucsSeparator:
     """Performs source separation using Demucs API."""
+    # Constructor arguments of each preset, overriding the defaults and the requested random shifts
+    PRESETS = {
+        'draft': {'overlap': 0.1, 'shifts': 0},
+        'standard': {},
+        'max': {'overlap': 0.5},
+    }
+
     def __init__(self,
                  model_name='mdx_extra_q',
                  cpu_separation=True,
                  output_format=OutputFormat.MP3_256.value,
-                 shifts=5):
+                 shifts=5,
+                 overlap=0.25,
+                 split=True):
         self.device = 'cpu' if cpu_separation else 'cuda'
         self.sample_rate = 44100
         self.model_name = model_name
         self.repo = None
         self.model_dir = Path('pretrained_models')
         self.shifts = shifts
-        self.split = True
-        self.overlap = 0.25
+        self.split = split
+        self.overlap = overlap
         self.workers = 0
         self.verbose = True
         self.audio_bitrate = f'{output_format}k' if is_output_format_lossy(output_format) else None
@@ -41,6 +54,11 @@ class DemucsSeparator:
         self.segment = int(settings.DEMUCS_SEGMENT_SIZE) if settings.DEMUCS_SEGMENT_SIZE else None
 
     def get_model(self):
+        """Get Demucs model, loading it only if it is not already resident in the model cache."""
+        key = (f'demucs/{self.model_name}', 'cpu', str(torch.float32))
+        return model_cache.get(key, self.load_model)
+
+    def load_model(self):
         torch.hub.set_dir(str(self.model_dir))
         try:
             model = get_model(self.model_name, self.repo)
@@ -61,10 +79,48 @@ class DemucsSeparator:
         model.eval()
         return model
 
-    def apply_model(self, model, input_path: Path):
-        """Applies model to waveform file"""
+    def download_model(self):
+        """
+        Download the checkpoints of the model into the torch hub cache, where get_model() looks for them, without
+        loading them.
+        """
+        torch.hub.set_dir(str(self.model_dir))
+        urls = _parse_remote_files(REMOTE_ROOT / 'files.txt')
+        # Bags of models list the signatures of their checkpoints
+        bag_path = REMOTE_ROOT / f'{self.model_name}.yaml'
+        signatures = yaml.safe_load(bag_path.read_text())['models'] if bag_path.is_file() else [self.model_name]
+        checkpoint_dir = Path(torch.hub.get_dir(), 'checkpoints')
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        for signature in signatures:
+            url = urls[signature]
+            filename = Path(urlparse(url).path).name
+            if not (checkpoint_dir / filename).is_file():
+                hash_prefix = torch.hub.HASH_REGEX.search(filename).group(1)
+                torch.hub.download_url_to_file(url, str(checkpoint_dir / filename), hash_prefix)
+
+    def warmup(self, load_model=True):
+        """Download the model and optionally load it and run a dummy forward pass.
+
+        :param load_model: Whether to load the model and run a dummy forward pass
+        """
+        if not load_model:
+            self.download_model()
+            return
+
+        model = self.get_model()
+        wav = torch.zeros((model.audio_channels, model.samplerate))
+        apply_model(model, wav[None], device=self.device, split=self.split,
+                    overlap=self.overlap, num_workers=self.workers)
+
+    def apply_model(self, model, input_path: Path, offset=0., duration=None):
+        """Applies model to waveform file, optionally limited to a time range in seconds"""
         print(f"Separating track {input_path}")
-        wav = load_track(input_path, model.audio_channels, model.samplerate)
+        if offset or duration is not None:
+            # Only decode the requested range
+            wav = AudioFile(input_path).read(seek_time=offset or None, duration=duration, streams=0,
+                                             samplerate=model.samplerate, channels=model.audio_channels)
+        else:
+            wav = load_track(input_path, model.audio_channels, model.samplerate)
 
         ref = wav.mean(0)
         wav -= ref.mean()
@@ -85,18 +141,20 @@ class DemucsSeparator:
             gc.collect()
         return raw_sources
 
-    def create_static_mix(self, parts, input_path: str, output_path: Path):
+    def create_static_mix(self, parts, input_path: str, output_path: Path, offset=0., duration=None):
         """Creates a static mix by performing source separation and adding the
            parts to be kept into a single track.
 
         :param parts: List of parts to keep ('vocals', 'drums', 'bass', 'other')
         :param input_path: Path to source file
         :param output_path: Path to output file
+        :param offset: Time in seconds of the source file to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
         """
         input_path = Path(input_path)
         model = self.get_model()
 
-        raw_sources = self.apply_model(model, input_path)
+        raw_sources = self.apply_model(model, input_path, offset, duration)
 
         final_source = None
 
@@ -114,17 +172,19 @@ class DemucsSeparator:
                                 self.audio_format, self.audio_bitrate)
 
 
-    def separate_into_parts(self, input_path: str, output_path: str):
+    def separate_into_parts(self, input_path: str, output_path: str, offset=0., duration=None):
         """Creates a dynamic mix
 
         :param input_path: Input path
         :param output_path: Output path
+        :param offset: Time in seconds of the input to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
         """
         input_path = Path(input_path)
         output_path = Path(output_path)
 
         model = self.get_model()
-        raw_sources = self.apply_model(model, input_path)
+        raw_sources = self.apply_model(model, input_path, offset, duration)
 
         # Export all sources in parallel
         pool = Pool()
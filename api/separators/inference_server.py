@@ -0,0 +1,179 @@
+import os
+import queue
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from threading import Event, Thread
+from typing import Callable, Dict, List, Optional
+
+import torch
+from django.conf import settings
+
+"""
+This module defines a local inference server that owns the loaded separation models of a host, and the client used
+by Celery tasks to run their segments on it. Segments submitted by concurrent jobs for the same model and outputs
+are batched into a single forward pass, so that the host keeps a single copy of each model and runs larger batches.
+"""
+
+# SECRET_KEY values shipped with the settings, which must not be used to authenticate clients
+DEFAULT_SECRET_KEYS = ('default', 'sekrit')
+
+
+def get_authkey() -> bytes:
+    """Return the key authenticating connections between workers and the inference server."""
+    return settings.SECRET_KEY.encode()
+
+
+class InferenceRequest:
+    """Segments submitted by a client, waiting to be batched with the segments of other clients."""
+    def __init__(self, model_args: Dict, stem_groups: Optional[List[List[int]]],
+                 complement_groups: Optional[List[int]], batch: torch.Tensor):
+        self.model_args = model_args
+        self.stem_groups = stem_groups
+        self.complement_groups = complement_groups
+        self.batch = batch
+        # Only requests for the same model, outputs and segment shape (e.g. dual mono) can share a forward pass
+        self.key = (tuple(sorted(model_args.items())), tuple(map(tuple, stem_groups or [])),
+                    tuple(complement_groups or []), tuple(batch.shape[1:]))
+        self.received = time.monotonic()
+        self.done = Event()
+        self.output = None
+        self.error = None
+
+
+class InferenceServer:
+    """Serves model forward passes to local clients over a Unix socket, batching segments across clients."""
+    def __init__(self, address: str, load_model: Callable[[Dict], torch.nn.Module], max_batch_size: int,
+                 max_delay: float):
+        """
+        :param address: Path of the Unix socket to listen on
+        :param load_model: Function returning the model for the model arguments sent by a client
+        :param max_batch_size: Number of segments above which a batch is run without waiting for more requests
+        :param max_delay: Seconds a request may wait for other requests to be batched with
+        """
+        self.address = address
+        self.load_model = load_model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        # Requests received while collecting a batch for other outputs
+        self.deferred = []
+
+    def serve_forever(self):
+        """Accept clients and run their requests until the process is stopped."""
+        if Path(self.address).is_socket():
+            # Left behind by a previous server
+            os.unlink(self.address)
+        Thread(target=self.run_batches, daemon=True).start()
+        with Listener(self.address, family='AF_UNIX', authkey=get_authkey()) as listener:
+            # Clients send pickled requests, so only the user running the server and workers may connect
+            os.chmod(self.address, 0o600)
+            print(f'Inference server listening on {self.address}')
+            while True:
+                try:
+                    connection = listener.accept()
+                except OSError as e:
+                    print(f'Failed to accept inference client: {e}')
+                    continue
+                Thread(target=self.handle_client, args=(connection, ), daemon=True).start()
+
+    def handle_client(self, connection: Connection):
+        """Submit the requests of a client one at a time and send back their outputs."""
+        with connection:
+            while True:
+                try:
+                    model_args, stem_groups, complement_groups, batch = connection.recv()
+                except (EOFError, OSError):
+                    return
+                request = InferenceRequest(model_args, stem_groups, complement_groups, torch.from_numpy(batch))
+                self.requests.put(request)
+                request.done.wait()
+                connection.send(('error', request.error) if request.error is not None else ('ok', request.output))
+
+    def next_request(self, timeout: Optional[float] = None) -> InferenceRequest:
+        """Return the oldest deferred request, or wait for a new one."""
+        if self.deferred:
+            return self.deferred.pop(0)
+        return self.requests.get(timeout=timeout)
+
+    def collect_batch(self) -> List[InferenceRequest]:
+        """
+        Wait for a request, then collect requests for the same model and outputs until the batch is full or the
+        first request has waited for max_delay.
+        """
+        first = self.next_request()
+        batch = [first]
+        size = first.batch.shape[0]
+        # Deferred requests were received earlier than new ones
+        for request in list(self.deferred):
+            if size >= self.max_batch_size:
+                break
+            if request.key == first.key:
+                self.deferred.remove(request)
+                batch.append(request)
+                size += request.batch.shape[0]
+
+        deadline = first.received + self.max_delay
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request.key != first.key:
+                self.deferred.append(request)
+                continue
+            batch.append(request)
+            size += request.batch.shape[0]
+        return batch
+
+    def run_batches(self):
+        """Run batches of requests one after another, so that each forward pass can use every core."""
+        while True:
+            batch = self.collect_batch()
+            first = batch[0]
+            try:
+                model = self.load_model(first.model_args)
+                device = next(model.parameters()).device
+                segments = torch.cat([request.batch for request in batch]).to(device)
+                with torch.inference_mode():
+                    output = model(segments, stem_groups=first.stem_groups, complement_groups=first.complement_groups)
+                outputs = output.cpu().split([request.batch.shape[0] for request in batch])
+                for request, request_output in zip(batch, outputs):
+                    request.output = request_output.numpy()
+            except Exception as e:
+                for request in batch:
+                    request.error = f'{type(e).__name__}: {e}'
+            for request in batch:
+                request.done.set()
+
+
+class RemoteModel:
+    """Runs a BS-RoFormer model hosted by an inference server, with the call signature of the model itself."""
+    def __init__(self, address: str, model_args: Dict):
+        """
+        :param address: Path of the Unix socket of the inference server
+        :param model_args: Arguments identifying the model on the server
+        :raises OSError: If the server is not running
+        """
+        self.model_args = model_args
+        self.connection = Client(address, family='AF_UNIX', authkey=get_authkey())
+
+    def __call__(self, batch: torch.Tensor, stem_groups: Optional[List[List[int]]] = None,
+                 complement_groups: Optional[List[int]] = None) -> torch.Tensor:
+        self.connection.send((self.model_args, stem_groups, complement_groups, batch.cpu().numpy()))
+        status, result = self.connection.recv()
+        if status != 'ok':
+            raise RuntimeError(f'Inference server error: {result}')
+        return torch.from_numpy(result).to(batch.device)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable
+
+import torch
+from django.conf import settings
+
+"""
+This module defines a process-wide registry of loaded separation models, so that consecutive Celery tasks
+handled by the same worker process can reuse a model instead of reloading it from disk.
+"""
+
+
+def get_model_size(model) -> int:
+    """Return the number of bytes held by the parameters and buffers of a model."""
+    if not isinstance(model, torch.nn.Module):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelCache:
+    """
+    LRU cache of loaded models keyed by (checkpoint path, device, dtype).
+
+    Models are evicted in least-recently-used order once either the maximum number of entries or the memory
+    budget is exceeded. The most recently loaded model is always kept, even if it alone exceeds the budget.
+    """
+    def __init__(self, max_models: int = 1, memory_limit: int = 0):
+        """
+        :param max_models: Maximum number of models to keep resident (0 disables caching)
+        :param memory_limit: Maximum total size of cached models in bytes (0 for no limit)
+        """
+        self.max_models = max_models
+        self.memory_limit = memory_limit
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = Lock()
+
+    def get(self, key: Hashable, loader: Callable):
+        """
+        Return the model stored under key, loading it with loader() on a cache miss.
+
+        :param key: Cache key, typically (checkpoint path, device, dtype)
+        :param loader: Zero-argument function that loads and returns the model
+        """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = loader()
+            if self.max_models <= 0:
+                return model
+
+            self._models[key] = model
+            self._sizes[key] = get_model_size(model)
+            self._evict()
+            return model
+
+    def _evict(self):
+        """Evict least recently used models until the cache is within its limits."""
+        while len(self._models) > 1:
+            over_count = len(self._models) > self.max_models
+            over_memory = self.memory_limit > 0 and self.total_size() > self.memory_limit
+            if not over_count and not over_memory:
+                break
+            key, _ = self._models.popitem(last=False)
+            del self._sizes[key]
+            print(f'Evicted model {key} from cache')
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def total_size(self) -> int:
+        """Return the total size of all cached models in bytes."""
+        return sum(self._sizes.values())
+
+    def clear(self):
+        """Remove all models from the cache."""
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+    def __contains__(self, key: Hashable):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+
+model_cache = ModelCache(max_models=settings.MODEL_CACHE_SIZE,
+                         memory_limit=settings.MODEL_CACHE_MEMORY_LIMIT * 1024 * 1024)
@@ -0,0 +1,222 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable
+
+import torch
+from django.conf import settings
+
+"""
+This module defines helpers to compile or trace the inference graph of a model for a fixed input shape, and to
+store the resulting artifacts on disk so that later worker processes can reuse them instead of recompiling.
+"""
+
+# TorchScript trace, frozen and optimized for inference
+COMPILE_MODE_TRACE = 'trace'
+# torch.compile, with its compiled kernels saved as portable cache artifacts
+COMPILE_MODE_COMPILE = 'compile'
+# ONNX graph run by ONNX Runtime on CPU
+COMPILE_MODE_ONNX = 'onnx'
+COMPILE_MODES = [COMPILE_MODE_TRACE, COMPILE_MODE_COMPILE, COMPILE_MODE_ONNX]
+
+ARTIFACT_SUFFIXES = {
+    COMPILE_MODE_TRACE: '.pt',
+    COMPILE_MODE_COMPILE: '.bin',
+    COMPILE_MODE_ONNX: '.onnx',
+}
+
+# Maximum difference between compiled and eager outputs relative to the largest eager output, per compute dtype
+PARITY_TOLERANCES = {
+    torch.float32: 1e-3,
+    torch.float16: 1e-2,
+    torch.bfloat16: 5e-2,
+}
+
+
+class MethodModule(torch.nn.Module):
+    """Exposes a method of a module as the forward() of a module, so that it can be traced or compiled."""
+    def __init__(self, module: torch.nn.Module, method_name: str):
+        super().__init__()
+        self.module = module
+        self.method_name = method_name
+
+    def forward(self, x):
+        return getattr(self.module, self.method_name)(x)
+
+
+class FixedBatch:
+    """Calls a function specialized for a fixed batch size, zero-padding smaller batches."""
+    def __init__(self, fn: Callable, batch_size: int):
+        self.fn = fn
+        self.batch_size = batch_size
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        outputs = []
+        for batch in x.split(self.batch_size):
+            size = batch.shape[0]
+            if size < self.batch_size:
+                batch = torch.cat([batch, batch.new_zeros((self.batch_size - size, *batch.shape[1:]))])
+            outputs.append(self.fn(batch)[:size])
+        return torch.cat(outputs)
+
+
+def get_compute_dtype(module: torch.nn.Module, device_type: str) -> torch.dtype:
+    """Return the dtype a module computes in, which is the autocast dtype if autocast is enabled."""
+    if torch.is_autocast_enabled(device_type):
+        return torch.get_autocast_dtype(device_type)
+    return next(module.parameters()).dtype
+
+
+def get_artifact_path(model_path: Path, mode: str, module: torch.nn.Module, example: torch.Tensor,
+                      variant: str = '') -> Path:
+    """
+    Return the path of the compiled artifact of a model, next to its checkpoint.
+
+    The file name depends on everything the artifact is specialized for, so that stale artifacts are never
+    reused after upgrading PyTorch or changing the input shape or precision.
+
+    :param model_path: Path to the checkpoint of the model
+    :param mode: Compile mode
+    :param module: Module to compile
+    :param example: Example input of the compiled graph
+    :param variant: Tag of weight transformations not reflected by the parameter dtype, e.g. 'qint8'
+    """
+    device_type = example.device.type
+    weight_dtype = next(module.parameters()).dtype
+    compute_dtype = get_compute_dtype(module, device_type)
+    key = (f'{torch.__version__}/{device_type}/{example.dtype}/{tuple(example.shape)}/{weight_dtype}/'
+           f'{compute_dtype}/{variant}')
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    return model_path.with_name(f'{model_path.stem}.{mode}-{digest}{ARTIFACT_SUFFIXES[mode]}')
+
+
+def write_artifact(path: Path, write: Callable[[str], None]):
+    """Write an artifact through a temporary file, so that concurrent workers never read a partial file."""
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    write(str(tmp_path))
+    os.replace(tmp_path, path)
+
+
+def trace_module(module: torch.nn.Module, example: torch.Tensor, path: Path) -> Callable:
+    """Load the traced module from path, or trace it with the example input and save it to path."""
+    if path.is_file():
+        print(f'Loading traced model from {path}...')
+        return torch.jit.load(str(path), map_location=example.device)
+
+    print(f'Tracing model to {path}...')
+    with torch.no_grad():
+        traced = torch.jit.trace(module.eval(), example)
+        traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    write_artifact(path, lambda tmp_path: torch.jit.save(traced, tmp_path))
+    return traced
+
+
+def compile_module(module: torch.nn.Module, example: torch.Tensor, path: Path) -> Callable:
+    """
+    Compile the module with torch.compile, reusing the cache artifacts at path if they exist, or saving the
+    artifacts produced by compiling it with the example input to path otherwise.
+    """
+    if path.is_file():
+        print(f'Loading compiled model artifacts from {path}...')
+        torch.compiler.load_cache_artifacts(path.read_bytes())
+
+    compiled = torch.compile(module, dynamic=False)
+    with torch.inference_mode():
+        compiled(example)
+
+    if not path.is_file():
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            print(f'Saving compiled model artifacts to {path}...')
+            artifact_bytes, _ = artifacts
+            write_artifact(path, lambda tmp_path: Path(tmp_path).write_bytes(artifact_bytes))
+    return compiled
+
+
+class OnnxRuntimeModule:
+    """Runs an ONNX graph with ONNX Runtime, taking and returning torch tensors."""
+    def __init__(self, path: Path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError('onnxruntime must be installed to run models with ONNX Runtime') from e
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.ONNX_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+        elif settings.CPU_PINNING:
+            # Match the thread pool of the pinned worker process
+            options.intra_op_num_threads = torch.get_num_threads()
+        if settings.ONNX_INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        inputs = {self.input_name: x.detach().cpu().float().numpy()}
+        output = self.session.run(None, inputs)[0]
+        return torch.from_numpy(output).to(x.device, x.dtype)
+
+
+def export_onnx(module: torch.nn.Module, example: torch.Tensor, path: Path) -> Callable:
+    """Export the module to an ONNX graph at path unless it already exists, and load it into ONNX Runtime."""
+    if not path.is_file():
+        print(f'Exporting model to {path}...')
+        with torch.no_grad():
+            write_artifact(
+                path, lambda tmp_path: torch.onnx.export(module.eval(), (example.float(), ), tmp_path,
+                                                         input_names=['input'], output_names=['output'],
+                                                         opset_version=17, dynamo=False))
+
+    print(f'Loading ONNX model from {path}...')
+    return OnnxRuntimeModule(path)
+
+
+def check_parity(compiled: Callable, expected: torch.Tensor, example: torch.Tensor, path: Path, tolerance: float):
+    """
+    Check that a compiled function reproduces the eager output for the example input, removing the artifact at
+    path if it does not so that it is rebuilt next time.
+    """
+    with torch.inference_mode():
+        output = compiled(example)
+    error = (output.float() - expected.float()).abs().max() / expected.float().abs().max().clamp(min=1e-10)
+    print(f'Compiled model relative error: {error.item():.2e}')
+    if error > tolerance:
+        path.unlink(missing_ok=True)
+        raise RuntimeError(f'Compiled model output differs from eager output by {error.item():.2e}')
+
+
+def compile_method(module: torch.nn.Module, method_name: str, example: torch.Tensor, mode: str,
+                   model_path: Path, variant: str = '') -> Callable:
+    """
+    Compile or trace a method of a module for the shape of the example input, caching the artifact next to the
+    model checkpoint. Inputs with a smaller batch size than the example are padded.
+
+    :param module: Module in eval mode, on the device and with the dtype used for inference
+    :param method_name: Name of the method taking a single tensor input
+    :param example: Example input with the batch size and shape used for inference
+    :param mode: Compile mode ('trace', 'compile' or 'onnx')
+    :param model_path: Path to the checkpoint of the model, next to which the artifact is stored
+    :param variant: Tag of weight transformations not reflected by the parameter dtype, e.g. 'qint8' for
+                    dynamically quantized modules, whose remaining parameters are still float32
+    :return: Function with the same signature as the method
+    """
+    if mode not in COMPILE_MODES:
+        raise ValueError(f'Unknown compile mode "{mode}", expected one of {COMPILE_MODES}.')
+
+    path = get_artifact_path(model_path, mode, module, example, variant)
+    method_module = MethodModule(module, method_name)
+    # Run eagerly once, so that lazily initialized state is not part of the compiled graph
+    with torch.no_grad():
+        expected = method_module(example)
+    if mode == COMPILE_MODE_TRACE:
+        compiled = trace_module(method_module, example, path)
+    elif mode == COMPILE_MODE_ONNX:
+        compiled = export_onnx(method_module, example, path)
+    else:
+        compiled = compile_module(method_module, example, path)
+    tolerance = PARITY_TOLERANCES.get(get_compute_dtype(module, example.device.type), PARITY_TOLERANCES[torch.float32])
+    check_parity(compiled, expected, example, path, tolerance)
+    return FixedBatch(compiled, example.shape[0])
@@ -0,0 +1,53 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+"""
+This module defines a per-job cache of model outputs keyed by the exact content of the input segment, so that
+bit-identical segments, e.g. repeated bars of loop-based tracks, are only run through the model once.
+"""
+
+
+class SegmentMemo:
+    """LRU cache of the outputs of at most max_segments segments, with hit statistics."""
+    def __init__(self, max_segments: int):
+        """
+        :param max_segments: Maximum number of segment outputs to keep
+        """
+        self.max_segments = max_segments
+        self._outputs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Time spent running the model on missed segments, to estimate the time saved by hits
+        self.compute_time = 0.
+
+    @staticmethod
+    def get_key(segment: torch.Tensor) -> bytes:
+        """Return the key of a segment, a hash of its exact samples."""
+        return hashlib.blake2b(segment.cpu().numpy().tobytes(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[torch.Tensor]:
+        """Return the output stored under key, or None, counting the lookup as a hit or miss."""
+        if key not in self._outputs:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._outputs.move_to_end(key)
+        return self._outputs[key]
+
+    def put(self, key: bytes, output: torch.Tensor):
+        """Store the output of a segment, evicting the least recently used outputs beyond max_segments."""
+        self._outputs[key] = output
+        self._outputs.move_to_end(key)
+        while len(self._outputs) > self.max_segments:
+            self._outputs.popitem(last=False)
+
+    def get_stats(self) -> str:
+        """Return a summary of the hit rate and estimated time saved."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.
+        time_saved = self.hits * self.compute_time / self.misses if self.misses else 0.
+        return (f'Reused the outputs of {self.hits} of {lookups} segments ({hit_rate:.1%}), '
+                f'saving about {time_saved:.1f} s')
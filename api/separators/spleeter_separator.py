@@ -3,11 +3,13 @@ from pathlib import Path
 import numpy as np
 from spleeter import *
 from spleeter.audio.adapter import AudioAdapter
+from spleeter.model.provider import ModelProvider
 from spleeter.separator import Separator
 from spleeter.utils import *
 from api.models import OutputFormat
 
 from api.util import output_format_to_ext, is_output_format_lossy
+from .model_cache import model_cache
 
 """
 This module defines a wrapper interface over the Spleeter API.
@@ -24,7 +26,10 @@ class SpleeterSeparator:
         self.audio_format = output_format_to_ext(output_format)
         self.sample_rate = 44100
         self.spleeter_stem = 'config/5stems-16kHz.json' if with_piano else 'config/4stems-16kHz.json'
-        self.separator = Separator(self.spleeter_stem, multiprocess=False)
+        # The TensorFlow graph of a Separator is built on its first separation, so the instance is shared by the
+        # tasks of the worker process through the model cache
+        self.separator = model_cache.get(('spleeter', self.spleeter_stem),
+                                         lambda: Separator(self.spleeter_stem, multiprocess=False))
         self.audio_adapter = AudioAdapter.default()
 
     def check_and_remove_empty_model_dirs(self):
@@ -36,16 +41,31 @@ class SpleeterSeparator:
             if model_path.exists() and not any(model_path.iterdir()):
                 model_path.rmdir()
 
-    def create_static_mix(self, parts, input_path, output_path):
+    def warmup(self, load_model=True):
+        """Download the model and optionally load it by separating one second of silence.
+
+        :param load_model: Whether to load the model and run a dummy separation
+        """
+        self.check_and_remove_empty_model_dirs()
+        if load_model:
+            self.separator.separate(np.zeros((self.sample_rate, 2), dtype=np.float32), '')
+        else:
+            ModelProvider.default().get(self.separator._params['model_dir'])
+
+    def create_static_mix(self, parts, input_path, output_path, offset=0., duration=None):
         """Creates a static mix by performing source separation and adding the
            parts to be kept into a single track.
 
         :param parts: List of parts to keep
         :param input_path: Path to source file
         :param output_path: Path to output file
+        :param offset: Time in seconds of the source file to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
         :raises e: FFMPEG error
         """
         waveform, _ = self.audio_adapter.load(input_path,
+                                              offset=offset,
+                                              duration=duration,
                                               sample_rate=self.sample_rate)
         self.check_and_remove_empty_model_dirs()
         prediction = self.separator.separate(waveform, '')
@@ -59,18 +79,21 @@ class SpleeterSeparator:
         self.audio_adapter.save(output_path, out, self.sample_rate,
                                 self.audio_format, self.audio_bitrate)
 
-    def separate_into_parts(self, input_path, output_path):
+    def separate_into_parts(self, input_path, output_path, offset=0., duration=None):
         """Creates a dynamic mix
 
         :param input_path: Input path
         :param output_path: Output path
+        :param offset: Time in seconds of the input to start separating at
+        :param duration: Duration in seconds to separate, or None to separate until the end
         """
         self.check_and_remove_empty_model_dirs()
         self.separator.separate_to_file(input_path,
                                         output_path,
                                         self.audio_adapter,
+                                        offset=offset,
+                                        duration=duration,
                                         codec=self.audio_format,
-                                        duration=None,
                                         bitrate=self.audio_bitrate,
                                         filename_format='{instrument}.{codec}',
                                         synchronous=False)
@@ -0,0 +1,116 @@
+import os
+import shutil
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from .audio_stream import AudioStreamReader, AudioStreamWriter
+
+"""
+This module defines a cache of the raw stems a separation model outputs for a source track, stored as FLAC files,
+so that mixes of any combination of the stems can later be derived by mixing and encoding alone.
+"""
+
+# Gain applied to stems before they are stored as 24-bit integer samples, so that peaks above full scale are not
+# clipped. This costs one of the 24 bits.
+HEADROOM = 0.5
+
+
+class StemCache:
+    """Raw stems of a track in a directory, with one FLAC file per stem."""
+    def __init__(self, directory: Path, stems: List[str], sample_rate: int, channels: int = 2):
+        """
+        :param directory: Directory holding the stems
+        :param stems: Names of the stems
+        :param sample_rate: Sample rate of the stems
+        :param channels: Number of channels of the stems
+        """
+        self.directory = directory
+        self.stems = stems
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def get_path(self, stem: str, directory: Path = None) -> Path:
+        return (directory or self.directory) / f'{stem}.flac'
+
+    def exists(self) -> bool:
+        """Return whether all stems are cached."""
+        return all(self.get_path(stem).is_file() for stem in self.stems)
+
+    @contextmanager
+    def open_writer(self) -> Iterator[Callable[[Dict[str, np.ndarray]], None]]:
+        """
+        Yield a function writing consecutive regions of the stems, as dicts mapping stem names to arrays of shape
+        (channels, samples). The stems are written to a temporary directory, which replaces the cache directory
+        once the with block exits without error, so that other jobs never read partial stems.
+        """
+        tmp_dir = self.directory.with_name(f'{self.directory.name}.{os.getpid()}.tmp')
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with ExitStack() as stack:
+                writers = {
+                    stem: stack.enter_context(
+                        AudioStreamWriter(self.get_path(stem, tmp_dir), self.sample_rate, self.channels, 'flac',
+                                          sample_fmt='s32'))
+                    for stem in self.stems
+                }
+
+                def write(sources: Dict[str, np.ndarray]):
+                    for stem, source in sources.items():
+                        writers[stem].write(source * HEADROOM)
+
+                yield write
+            try:
+                os.replace(tmp_dir, self.directory)
+            except OSError:
+                # The stems were cached by a concurrent job in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def read(self, reader: AudioStreamReader,
+             block_size: int) -> Iterator[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """
+        Yield consecutive blocks of the mix from reader along with the same blocks of the cached stems.
+
+        :param reader: Reader of the audio the stems were separated from
+        :param block_size: Number of samples per block
+        :return: Tuples of the mix block and a dict mapping stem names to stem blocks
+        """
+        with ExitStack() as stack:
+            stem_readers = {
+                stem: stack.enter_context(AudioStreamReader(str(self.get_path(stem)), self.sample_rate,
+                                                            self.channels))
+                for stem in self.stems
+            }
+            while True:
+                mix = reader.read(block_size)
+                stems = {stem: stem_reader.read(block_size) / HEADROOM for stem, stem_reader in stem_readers.items()}
+                length = min(mix.shape[-1], *(stem.shape[-1] for stem in stems.values()))
+                if length > 0:
+                    yield mix[..., :length], {name: stem[..., :length] for name, stem in stems.items()}
+                if length < block_size:
+                    return
+
+
+def mix_stems(mix: np.ndarray, stems: Dict[str, np.ndarray], groups: Dict[str, List[str]],
+              complements: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Derive outputs from the raw stems of a track.
+
+    :param mix: Audio the stems were separated from
+    :param stems: Dict mapping stem names to stems
+    :param groups: Dict mapping output names to the stems merged into them
+    :param complements: Names of the outputs computed as the mix minus the stems not in their group
+    :return: Dict mapping output names to outputs
+    """
+    outputs = {}
+    for name, group in groups.items():
+        if name in complements:
+            outputs[name] = mix - sum((stem for stem_name, stem in stems.items() if stem_name not in group),
+                                      np.zeros_like(mix))
+        else:
+            outputs[name] = sum((stems[stem_name] for stem_name in group), np.zeros_like(mix))
+    return outputs
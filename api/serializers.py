@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import *
 from .validators import is_valid_youtube
@@ -23,6 +24,21 @@ class ChoicesSerializerField(serializers.SerializerMethodField):
         method = getattr(value, method_name)
         return method()
 
+def validate_time_range(data):
+    """
+    Validate the time range of a mix, where an end time of 0 means the end of the track.
+
+    :param data: Request data
+    """
+    start_time = data.get('start_time', 0)
+    end_time = data.get('end_time', 0)
+    if start_time < 0 or end_time < 0:
+        raise serializers.ValidationError(
+            {'time_range': 'Start and end times must not be negative.'})
+    if end_time and end_time <= start_time:
+        raise serializers.ValidationError(
+            {'time_range': 'End time must be after start time.'})
+
 class YTLinkSerializer(serializers.Serializer):
     """Simple serializer for a valid YouTube video URL."""
     link = serializers.URLField(validators=[is_valid_youtube])
@@ -54,6 +70,8 @@ class LiteDynamicMixSerializer(serializers.ModelSerializer):
     """Serializer for DynamicMix model with minimal information."""
     # The status of the source separation task
     status = ChoicesSerializerField()
+    # The quality of the stems currently available ('None', 'Preview' or 'Final')
+    quality_tier = ChoicesSerializerField()
     # Extra information about mix
     extra_info = serializers.ListField(child=serializers.CharField(),
                                        source='get_extra_info',
@@ -62,9 +80,9 @@ class LiteDynamicMixSerializer(serializers.ModelSerializer):
     class Meta:
         model = DynamicMix
         fields = ('id', 'source_track', 'separator', 'bitrate', 'extra_info',
-                  'artist', 'title', 'vocals_url', 'other_url', 'piano_url',
-                  'bass_url', 'drums_url', 'guitar_url', 'status', 'error', 'date_created',
-                  'date_finished')
+                  'start_time', 'end_time', 'artist', 'title', 'vocals_url', 'other_url', 'piano_url',
+                  'bass_url', 'drums_url', 'guitar_url', 'status', 'progressive', 'quality_tier',
+                  'error', 'date_created', 'date_finished')
 
 class LiteStaticMixSerializer(serializers.ModelSerializer):
     """Serializer for StaticMix model with minimal information."""
@@ -77,7 +95,7 @@ class LiteStaticMixSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = StaticMix
-        fields = ('id', 'source_track', 'separator', 'extra_info', 'artist',
+        fields = ('id', 'source_track', 'separator', 'extra_info', 'start_time', 'end_time', 'artist',
                   'title', 'vocals', 'drums', 'bass', 'other', 'piano', 'guitar', 'status', 'url',
                   'error', 'date_created', 'date_finished')
 
@@ -86,6 +104,8 @@ class FullDynamicMixSerializer(serializers.ModelSerializer):
     separator_args = PickledObjectSerializerField()
     # The status of the source separation task
     status = ChoicesSerializerField()
+    # The quality of the stems currently available ('None', 'Preview' or 'Final')
+    quality_tier = ChoicesSerializerField()
 
     def validate(self, data):
         """
@@ -109,15 +129,37 @@ class FullDynamicMixSerializer(serializers.ModelSerializer):
             except KeyError:
                 raise serializers.ValidationError(
                     {'args': "Must include 'random_shifts' argument."})
+            if random_shifts > 0 and args.get('preset', PRESET_STANDARD) == PRESET_DRAFT:
+                raise serializers.ValidationError(
+                    {'args': 'Random shifts are not supported by the draft preset.'})
+        elif data['separator'] in BS_ROFORMER_FAMILY:
+            if not isinstance(args.get('quantize', False), bool):
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument must be a boolean."})
+            if args.get('precision', 'fp32') not in BS_ROFORMER_PRECISIONS:
+                raise serializers.ValidationError(
+                    {'args': f"'precision' argument must be one of {BS_ROFORMER_PRECISIONS}."})
+            if args.get('quantize', False) and not settings.CPU_SEPARATION:
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument is only supported for CPU separation."})
+            if args.get('quantize', False) and args.get('precision', 'fp32') != 'fp32':
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument is only supported with 'fp32' precision."})
+
+        if data['separator'] in DEMUCS_FAMILY or data['separator'] in BS_ROFORMER_FAMILY:
+            if args.get('preset', PRESET_STANDARD) not in PRESETS:
+                raise serializers.ValidationError(
+                    {'args': f"'preset' argument must be one of {PRESETS}."})
 
+        validate_time_range(data)
         return data
 
     class Meta:
         model = DynamicMix
         fields = ('id', 'celery_id', 'source_track', 'separator',
-                  'separator_args', 'bitrate', 'artist', 'title',
+                  'separator_args', 'bitrate', 'start_time', 'end_time', 'artist', 'title',
                   'vocals_url', 'other_url', 'piano_url', 'bass_url', 'drums_url', 'guitar_url', 'status',
-                  'error', 'date_created', 'date_finished')
+                  'progressive', 'quality_tier', 'error', 'date_created', 'date_finished')
 
 class FullStaticMixSerializer(serializers.ModelSerializer):
     """Serializer for StaticMix model."""
@@ -173,13 +215,35 @@ class FullStaticMixSerializer(serializers.ModelSerializer):
             except KeyError:
                 raise serializers.ValidationError(
                     {'args': "Must include 'random_shifts' argument."})
+            if random_shifts > 0 and args.get('preset', PRESET_STANDARD) == PRESET_DRAFT:
+                raise serializers.ValidationError(
+                    {'args': 'Random shifts are not supported by the draft preset.'})
+        elif data['separator'] in BS_ROFORMER_FAMILY:
+            if not isinstance(args.get('quantize', False), bool):
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument must be a boolean."})
+            if args.get('precision', 'fp32') not in BS_ROFORMER_PRECISIONS:
+                raise serializers.ValidationError(
+                    {'args': f"'precision' argument must be one of {BS_ROFORMER_PRECISIONS}."})
+            if args.get('quantize', False) and not settings.CPU_SEPARATION:
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument is only supported for CPU separation."})
+            if args.get('quantize', False) and args.get('precision', 'fp32') != 'fp32':
+                raise serializers.ValidationError(
+                    {'args': "'quantize' argument is only supported with 'fp32' precision."})
+
+        if data['separator'] in DEMUCS_FAMILY or data['separator'] in BS_ROFORMER_FAMILY:
+            if args.get('preset', PRESET_STANDARD) not in PRESETS:
+                raise serializers.ValidationError(
+                    {'args': f"'preset' argument must be one of {PRESETS}."})
 
+        validate_time_range(data)
         return data
 
     class Meta:
         model = StaticMix
         fields = ('id', 'celery_id', 'source_track', 'separator',
-                  'separator_args', 'bitrate', 'artist', 'title',
+                  'separator_args', 'bitrate', 'start_time', 'end_time', 'artist', 'title',
                   'vocals', 'drums', 'bass', 'other', 'guitar', 'piano', 'status', 'url', 'error',
                   'date_created', 'date_finished')
 
@@ -2,24 +2,31 @@ import os
 import os.path
 import pathlib
 import shutil
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import traceback
 
+import ffmpeg
 from billiard.context import Process
 from billiard.exceptions import SoftTimeLimitExceeded
+from billiard.process import current_process
+from celery import chord
+from celery.signals import celeryd_after_setup, worker_process_init
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.utils import timezone
 
 from .celery import app
 from .models import (DEMUCS_FAMILY, D3NET, SPLEETER, SPLEETER_PIANO, XUMX, BS_ROFORMER,
                      BS_ROFORMER_5S_GUITAR, BS_ROFORMER_5S_PIANO, BS_ROFORMER_6S,
-                     BS_ROFORMER_FAMILY,
-                     DynamicMix, SourceFile, StaticMix, TaskStatus,
+                     BS_ROFORMER_FAMILY, PRESET_STANDARD,
+                     DynamicMix, OutputFormat, QualityTier, SourceFile, StaticMix, TaskStatus,
                      YTAudioDownloadTask)
 from .separators.demucs_separator import DemucsSeparator
 from .separators.spleeter_separator import SpleeterSeparator
 from .separators.bs_roformer_separator import BSRoformerSeparator
+from .separators.chunking import plan_chunks
+from .separators.cpu_affinity import pin_worker_process
 from .util import ALL_PARTS, ALL_PARTS_5_PIANO, ALL_PARTS_5_GUITAR, ALL_PARTS_6, output_format_to_ext, get_valid_filename
 from .youtubedl import download_audio, get_file_ext
 
@@ -28,11 +35,17 @@ This module defines various Celery tasks used for Spleeter Web.
 """
 
 LEGACY_SEPARATORS = {D3NET, XUMX}
+MIX_MODELS = {'static': StaticMix, 'dynamic': DynamicMix}
+# Subdirectory of a dynamic mix holding its provisional preview parts
+PREVIEW_DIR = 'preview'
 
 
 def get_separator(separator: str, separator_args: Dict, bitrate: int,
-                  cpu_separation: bool):
-    """Returns separator object for corresponding source separation model."""
+                  cpu_separation: bool, stem_cache_dir: Optional[str] = None):
+    """
+    Returns separator object for corresponding source separation model.
+    :param stem_cache_dir: Directory to cache the raw stems of the source track in, for separators that support it
+    """
     if separator in LEGACY_SEPARATORS:
         raise ValueError(
             f'{separator} is no longer supported for new separations.')
@@ -49,13 +62,74 @@ def get_separator(separator: str, separator_args: Dict, bitrate: int,
             BS_ROFORMER_6S: '6stem',
         }
         stem_mode = stem_mode_map.get(separator, '4stem')
-        return BSRoformerSeparator(cpu_separation=cpu_separation, output_format=bitrate, stem_mode=stem_mode)
+        quantize = separator_args.get('quantize', False)
+        precision = separator_args.get('precision')
+        preset_args = BSRoformerSeparator.PRESETS[separator_args.get('preset', PRESET_STANDARD)]
+        return BSRoformerSeparator(cpu_separation=cpu_separation, output_format=bitrate, stem_mode=stem_mode,
+                                   quantize=quantize, precision=precision, stem_cache_dir=stem_cache_dir,
+                                   **preset_args)
     if separator in DEMUCS_FAMILY:
         random_shifts = separator_args.get('random_shifts', 0)
+        preset_args = DemucsSeparator.PRESETS[separator_args.get('preset', PRESET_STANDARD)]
         return DemucsSeparator(separator, cpu_separation, bitrate,
-                               random_shifts)
+                               **{'shifts': random_shifts, **preset_args})
     raise ValueError(f'Unknown separator "{separator}".')
 
+# Whether this worker consumes separation tasks and should warm up separators
+should_warmup = False
+# Number of separation worker processes to partition the CPUs among, or 0 to leave them unpinned
+pinned_concurrency = 0
+
+def warmup_separators(load_models: bool):
+    """
+    Download and verify the models of all separators listed in the WARMUP_SEPARATORS setting.
+
+    :param load_models: Whether to also load each model and run a dummy forward pass
+    """
+    for separator_name in settings.WARMUP_SEPARATORS:
+        print(f'Warming up {separator_name}...')
+        try:
+            separator = get_separator(separator_name, {}, OutputFormat.MP3_256.value,
+                                      settings.CPU_SEPARATION)
+            separator.warmup(load_models)
+        except Exception:
+            print(traceback.format_exc())
+            print(f'Failed to warm up {separator_name}')
+
+@celeryd_after_setup.connect
+def download_separator_models(sender, instance, **kwargs):
+    """Download models before the worker starts consuming separation tasks."""
+    global should_warmup, pinned_concurrency
+    queues = instance.app.amqp.queues.consume_from
+    should_warmup = bool(settings.WARMUP_SEPARATORS) and 'slow_queue' in queues
+    if settings.CPU_PINNING and settings.CPU_SEPARATION and 'slow_queue' in queues:
+        pinned_concurrency = instance.concurrency
+    if should_warmup:
+        warmup_separators(load_models=False)
+
+@worker_process_init.connect
+def pin_separator_process(**kwargs):
+    """
+    Pin each worker process to its own share of the CPUs before it loads any model.
+
+    Replacement processes reuse the index of the process they replace, and hence its CPUs.
+    """
+    index = getattr(current_process(), 'index', None)
+    if pinned_concurrency and index is not None:
+        cpus = pin_worker_process(index, pinned_concurrency)
+        print(f'Worker process {index} pinned to {len(cpus)} CPUs: {cpus}')
+
+@worker_process_init.connect
+def load_separator_models(**kwargs):
+    """
+    Load models into each worker process before it accepts separation tasks.
+
+    For GPU separation, tasks run in a separate process, so models are only downloaded.
+    """
+    if should_warmup and settings.CPU_SEPARATION:
+        warmup_separators(load_models=True)
+        print('Worker warm-up complete')
+
 @app.task()
 def create_static_mix(static_mix_id):
     """
@@ -72,25 +146,17 @@ def create_static_mix(static_mix_id):
     static_mix.status = TaskStatus.IN_PROGRESS
     static_mix.save()
 
-    ext = output_format_to_ext(static_mix.bitrate)
-
     try:
         # Get paths
-        directory = os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR,
-                                 static_mix_id)
-        filename = get_valid_filename(static_mix.formatted_name()) + f'.{ext}'
-        rel_media_path = os.path.join(settings.SEPARATE_DIR, static_mix_id,
-                                      filename)
-        rel_path = os.path.join(settings.MEDIA_ROOT, rel_media_path)
-        rel_path_dir = os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR,
-                                    static_mix_id)
+        directory, filename, rel_media_path, rel_path = get_static_mix_paths(static_mix)
 
         pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
         try:
             separator = get_separator(static_mix.separator,
                                       static_mix.separator_args,
                                       static_mix.bitrate,
-                                      settings.CPU_SEPARATION)
+                                      settings.CPU_SEPARATION,
+                                      get_stem_cache_dir(static_mix))
         except ValueError as exc:
             static_mix.status = TaskStatus.ERROR
             static_mix.error = str(exc)
@@ -98,62 +164,19 @@ def create_static_mix(static_mix_id):
             static_mix.save()
             return
 
-        parts = {
-            'vocals': static_mix.vocals,
-            'drums': static_mix.drums,
-            'bass': static_mix.bass,
-            'other': static_mix.other
-        }
-        if static_mix.separator == SPLEETER_PIANO:
-            parts['piano'] = static_mix.piano
-        elif static_mix.separator == BS_ROFORMER_5S_GUITAR:
-            parts['guitar'] = static_mix.guitar
-        elif static_mix.separator == BS_ROFORMER_5S_PIANO:
-            parts['piano'] = static_mix.piano
-        elif static_mix.separator == BS_ROFORMER_6S:
-            parts['guitar'] = static_mix.guitar
-            parts['piano'] = static_mix.piano
-
-        # Non-local filesystems like S3/Azure Blob do not support source_path()
-        is_local = settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage'
-        path = static_mix.source_path() if is_local else static_mix.source_url(
-        )
-
-        if not settings.CPU_SEPARATION:
-            # For GPU separation, do separation in separate process.
-            # Otherwise, GPU memory is not automatically freed afterwards
-            process_eval = Process(target=separator.create_static_mix,
-                                   args=(parts, path, rel_path))
-            process_eval.start()
-            try:
-                process_eval.join()
-            except SoftTimeLimitExceeded as e:
-                # Kill process if user aborts task
-                process_eval.terminate()
-                raise e
-        else:
-            separator.create_static_mix(parts, path, rel_path)
+        parts = get_static_mix_parts(static_mix)
+        path = get_source_path(static_mix)
+        offset, duration = get_source_range(static_mix)
 
-        # Check file exists
-        if os.path.exists(rel_path):
-            static_mix.status = TaskStatus.DONE
-            static_mix.date_finished = timezone.now()
-            if is_local:
-                # File is already on local filesystem
-                static_mix.file.name = rel_media_path
-            else:
-                # Need to copy local file to S3/Azure Blob/etc.
-                raw_file = open(rel_path, 'rb')
-                content_file = ContentFile(raw_file.read())
-                content_file.name = filename
-                static_mix.file = content_file
-                # Remove local file
-                os.remove(rel_path)
-                # Remove empty directory
-                os.rmdir(rel_path_dir)
-            static_mix.save()
-        else:
-            raise Exception('Error writing to file')
+        chunks = get_chunks(separator, path, offset, duration)
+        if chunks is not None:
+            # Separate chunks of the track in parallel, then stitch them in a final task
+            start_chunked_separation('static', static_mix_id, chunks,
+                                     finish_chunked_static_mix.s(static_mix_id))
+            return
+
+        run_separation(separator.create_static_mix, parts, path, rel_path, offset, duration)
+        save_static_mix(static_mix, directory, filename, rel_media_path, rel_path)
     except FileNotFoundError as error:
         print(error)
         print('Please make sure you have FFmpeg and FFprobe installed.')
@@ -188,19 +211,16 @@ def create_dynamic_mix(dynamic_mix_id):
 
     try:
         # Get paths
-        directory = os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR,
-                                 dynamic_mix_id)
         rel_media_path = os.path.join(settings.SEPARATE_DIR, dynamic_mix_id)
-        file_prefix = get_valid_filename(dynamic_mix.formatted_prefix())
-        file_suffix = dynamic_mix.formatted_suffix()
         rel_path = os.path.join(settings.MEDIA_ROOT, rel_media_path)
 
-        pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(rel_path).mkdir(parents=True, exist_ok=True)
         try:
             separator = get_separator(dynamic_mix.separator,
                                       dynamic_mix.separator_args,
                                       dynamic_mix.bitrate,
-                                      settings.CPU_SEPARATION)
+                                      settings.CPU_SEPARATION,
+                                      get_stem_cache_dir(dynamic_mix))
         except ValueError as exc:
             dynamic_mix.status = TaskStatus.ERROR
             dynamic_mix.error = str(exc)
@@ -208,53 +228,33 @@ def create_dynamic_mix(dynamic_mix_id):
             dynamic_mix.save()
             return
 
-        all_parts = ALL_PARTS_5_PIANO if dynamic_mix.separator == SPLEETER_PIANO else ALL_PARTS
-        if dynamic_mix.separator == BS_ROFORMER_5S_GUITAR:
-            all_parts = ALL_PARTS_5_GUITAR
-        elif dynamic_mix.separator == BS_ROFORMER_5S_PIANO:
-            all_parts = ALL_PARTS_5_PIANO
-        elif dynamic_mix.separator == BS_ROFORMER_6S:
-            all_parts = ALL_PARTS_6
+        path = get_source_path(dynamic_mix)
+        offset, duration = get_source_range(dynamic_mix)
 
-        # Non-local filesystems like S3/Azure Blob do not support source_path()
-        is_local = settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage'
-        path = dynamic_mix.source_path(
-        ) if is_local else dynamic_mix.source_url()
-
-        # Do separation
-        if not settings.CPU_SEPARATION:
-            # For GPU separation, do separation in separate process.
-            # Otherwise, GPU memory is not automatically freed afterwards
-            process_eval = Process(target=separator.separate_into_parts,
-                                   args=(path, rel_path))
-            process_eval.start()
+        if dynamic_mix.progressive and not isinstance(separator, SpleeterSeparator):
+            # Publish provisional stems, which are replaced once the requested separator finishes
             try:
-                process_eval.join()
-            except SoftTimeLimitExceeded as e:
-                # Kill process if user aborts task
-                process_eval.terminate()
-                raise e
-        else:
-            separator.separate_into_parts(path, rel_path)
+                save_preview_dynamic_mix(dynamic_mix, path, offset, duration, rel_media_path, rel_path)
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+                print('Failed to create preview stems')
+
+        chunks = get_chunks(separator, path, offset, duration)
+        if chunks is not None:
+            # Separate chunks of the track in parallel, then stitch them in a final task
+            start_chunked_separation('dynamic', dynamic_mix_id, chunks,
+                                     finish_chunked_dynamic_mix.s(dynamic_mix_id))
+            return
 
-        ext = output_format_to_ext(dynamic_mix.bitrate)
-        # Check all parts exist
-        if exists_all_parts(rel_path, ext, all_parts):
-            rename_all_parts(rel_path, file_prefix, file_suffix, ext,
-                             all_parts)
-            dynamic_mix.status = TaskStatus.DONE
-            dynamic_mix.date_finished = timezone.now()
-            if is_local:
-                save_to_local_storage(dynamic_mix, rel_media_path, file_prefix,
-                                      file_suffix, ext, all_parts)
-            else:
-                save_to_ext_storage(dynamic_mix, rel_path, file_prefix,
-                                    file_suffix, ext, all_parts)
-        else:
-            raise Exception('Error writing to file')
+        # Do separation
+        run_separation(separator.separate_into_parts, path, rel_path, offset, duration)
+        save_dynamic_mix(dynamic_mix, rel_media_path, rel_path)
     except FileNotFoundError as error:
         print(traceback.format_exc())
         print('Please make sure you have FFmpeg and FFprobe installed.')
+        discard_preview_dynamic_mix(dynamic_mix)
         dynamic_mix.status = TaskStatus.ERROR
         dynamic_mix.date_finished = timezone.now()
         dynamic_mix.error = str(error)
@@ -263,11 +263,109 @@ def create_dynamic_mix(dynamic_mix_id):
         print('Aborted!')
     except Exception as error:
         print(traceback.format_exc())
+        discard_preview_dynamic_mix(dynamic_mix)
         dynamic_mix.status = TaskStatus.ERROR
         dynamic_mix.date_finished = timezone.now()
         dynamic_mix.error = str(error)
         dynamic_mix.save()
 
+@app.task()
+def separate_chunk(mix_type: str, mix_id: str, chunk_dir: str, start: int, length: Optional[int]):
+    """
+    Task to separate a chunk of the source track of a mix, as part of a chunked separation.
+    :param mix_type: Type of the mix ('static' or 'dynamic')
+    :param mix_id: The id of the mix
+    :param chunk_dir: Directory to save the separated chunk to
+    :param start: First sample of the chunk, relative to the start of the time range of the mix
+    :param length: Number of samples of the chunk, or None for the rest of the track
+    :return: chunk_dir, for the task stitching the chunks
+    """
+    # Fails the whole chunked separation if the mix was deleted in the meantime
+    mix = MIX_MODELS[mix_type].objects.get(id=mix_id)
+    separator = get_separator(mix.separator, mix.separator_args, mix.bitrate,
+                              settings.CPU_SEPARATION)
+    parts = get_static_mix_parts(mix) if mix_type == 'static' else None
+    offset, duration = get_source_range(mix)
+    run_separation(separator.separate_chunk, get_source_path(mix), chunk_dir,
+                   start, length, parts, offset, duration)
+    return chunk_dir
+
+@app.task()
+def finish_chunked_static_mix(chunk_dirs: List[str], static_mix_id):
+    """
+    Task to stitch the separated chunks of a static mix and write it to the appropriate storage backend.
+    :param chunk_dirs: Directories of the separated chunks, in order
+    :param static_mix_id: The id of the StaticMix being processed
+    """
+    try:
+        static_mix = StaticMix.objects.get(id=static_mix_id)
+    except StaticMix.DoesNotExist:
+        print('StaticMix does not exist')
+        return
+
+    try:
+        directory, filename, rel_media_path, rel_path = get_static_mix_paths(static_mix)
+        separator = get_separator(static_mix.separator,
+                                  static_mix.separator_args,
+                                  static_mix.bitrate, settings.CPU_SEPARATION)
+        separator.stitch_chunks(chunk_dirs, get_chunk_overlap(separator),
+                                {'mix': rel_path})
+        shutil.rmtree(get_chunks_dir(static_mix_id), ignore_errors=True)
+        save_static_mix(static_mix, directory, filename, rel_media_path, rel_path)
+    except Exception as error:
+        print(traceback.format_exc())
+        set_mix_error(static_mix, error)
+
+@app.task()
+def finish_chunked_dynamic_mix(chunk_dirs: List[str], dynamic_mix_id):
+    """
+    Task to stitch the separated chunks of a dynamic mix and write it to the appropriate storage backend.
+    :param chunk_dirs: Directories of the separated chunks, in order
+    :param dynamic_mix_id: The id of the DynamicMix being processed
+    """
+    try:
+        dynamic_mix = DynamicMix.objects.get(id=dynamic_mix_id)
+    except DynamicMix.DoesNotExist:
+        print('DynamicMix does not exist')
+        return
+
+    try:
+        rel_media_path = os.path.join(settings.SEPARATE_DIR, dynamic_mix_id)
+        rel_path = os.path.join(settings.MEDIA_ROOT, rel_media_path)
+        ext = output_format_to_ext(dynamic_mix.bitrate)
+        separator = get_separator(dynamic_mix.separator,
+                                  dynamic_mix.separator_args,
+                                  dynamic_mix.bitrate, settings.CPU_SEPARATION)
+        output_paths = {
+            part: os.path.join(rel_path, f'{part}.{ext}')
+            for part in get_all_parts(dynamic_mix.separator)
+        }
+        separator.stitch_chunks(chunk_dirs, get_chunk_overlap(separator),
+                                output_paths)
+        shutil.rmtree(get_chunks_dir(dynamic_mix_id), ignore_errors=True)
+        save_dynamic_mix(dynamic_mix, rel_media_path, rel_path)
+    except Exception as error:
+        print(traceback.format_exc())
+        discard_preview_dynamic_mix(dynamic_mix)
+        set_mix_error(dynamic_mix, error)
+
+@app.task()
+def fail_chunked_mix(request, exc, exc_traceback, mix_type: str, mix_id: str):
+    """
+    Error callback of a chunked separation, marking the mix as failed.
+    :param mix_type: Type of the mix ('static' or 'dynamic')
+    :param mix_id: The id of the mix
+    """
+    shutil.rmtree(get_chunks_dir(mix_id), ignore_errors=True)
+    try:
+        mix = MIX_MODELS[mix_type].objects.get(id=mix_id)
+    except MIX_MODELS[mix_type].DoesNotExist:
+        # Mix was deleted while its chunks were being separated
+        return
+    if mix_type == 'dynamic':
+        discard_preview_dynamic_mix(mix)
+    set_mix_error(mix, exc)
+
 @app.task(autoretry_for=(Exception, ),
           default_retry_delay=3,
           retry_kwargs={'max_retries': settings.YOUTUBE_MAX_RETRIES})
@@ -432,3 +530,237 @@ def save_to_ext_storage(dynamic_mix, rel_path_dir, file_prefix: str,
     dynamic_mix.save()
 
     shutil.rmtree(rel_path_dir, ignore_errors=True)
+
+def set_mix_error(mix, error):
+    """Marks a StaticMix or DynamicMix as failed with the given error."""
+    mix.status = TaskStatus.ERROR
+    mix.date_finished = timezone.now()
+    mix.error = str(error)
+    mix.save()
+
+def get_source_path(mix) -> str:
+    """Returns the path or URL of the source track of a mix."""
+    # Non-local filesystems like S3/Azure Blob do not support source_path()
+    is_local = settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage'
+    return mix.source_path() if is_local else mix.source_url()
+
+def get_source_range(mix) -> Tuple[float, Optional[float]]:
+    """Returns the offset and duration in seconds of the time range of a mix, the duration being None until the end."""
+    duration = mix.end_time - mix.start_time if mix.end_time else None
+    return mix.start_time, duration
+
+def run_separation(target, *args):
+    """Runs a separation function, in a separate process for GPU separation."""
+    if settings.CPU_SEPARATION:
+        target(*args)
+        return
+
+    # For GPU separation, do separation in separate process.
+    # Otherwise, GPU memory is not automatically freed afterwards
+    process_eval = Process(target=target, args=args)
+    process_eval.start()
+    try:
+        process_eval.join()
+    except SoftTimeLimitExceeded as e:
+        # Kill process if user aborts task
+        process_eval.terminate()
+        raise e
+
+def get_static_mix_parts(static_mix) -> Dict[str, bool]:
+    """Returns a dict mapping each part of the separator of a static mix to whether it is kept."""
+    parts = {
+        'vocals': static_mix.vocals,
+        'drums': static_mix.drums,
+        'bass': static_mix.bass,
+        'other': static_mix.other
+    }
+    if static_mix.separator == SPLEETER_PIANO:
+        parts['piano'] = static_mix.piano
+    elif static_mix.separator == BS_ROFORMER_5S_GUITAR:
+        parts['guitar'] = static_mix.guitar
+    elif static_mix.separator == BS_ROFORMER_5S_PIANO:
+        parts['piano'] = static_mix.piano
+    elif static_mix.separator == BS_ROFORMER_6S:
+        parts['guitar'] = static_mix.guitar
+        parts['piano'] = static_mix.piano
+    return parts
+
+def get_all_parts(separator: str) -> List[str]:
+    """Returns the parts output by a separator for a dynamic mix."""
+    if separator == BS_ROFORMER_5S_GUITAR:
+        return ALL_PARTS_5_GUITAR
+    if separator in (SPLEETER_PIANO, BS_ROFORMER_5S_PIANO):
+        return ALL_PARTS_5_PIANO
+    if separator == BS_ROFORMER_6S:
+        return ALL_PARTS_6
+    return ALL_PARTS
+
+def get_static_mix_paths(static_mix):
+    """
+    Returns the paths of the output of a static mix.
+    :return: Tuple of the mix directory, the output filename, its path relative to media/ and its local path
+    """
+    static_mix_id = str(static_mix.id)
+    ext = output_format_to_ext(static_mix.bitrate)
+    directory = os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR,
+                             static_mix_id)
+    filename = get_valid_filename(static_mix.formatted_name()) + f'.{ext}'
+    rel_media_path = os.path.join(settings.SEPARATE_DIR, static_mix_id,
+                                  filename)
+    rel_path = os.path.join(settings.MEDIA_ROOT, rel_media_path)
+    return directory, filename, rel_media_path, rel_path
+
+def save_static_mix(static_mix, directory, filename, rel_media_path, rel_path):
+    """Saves the separated output of a static mix to the storage backend and marks it as done."""
+    # Check file exists
+    if not os.path.exists(rel_path):
+        raise Exception('Error writing to file')
+
+    static_mix.status = TaskStatus.DONE
+    static_mix.date_finished = timezone.now()
+    if settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage':
+        # File is already on local filesystem
+        static_mix.file.name = rel_media_path
+    else:
+        # Need to copy local file to S3/Azure Blob/etc.
+        raw_file = open(rel_path, 'rb')
+        content_file = ContentFile(raw_file.read())
+        content_file.name = filename
+        static_mix.file = content_file
+        # Remove local file
+        os.remove(rel_path)
+        # Remove empty directory
+        os.rmdir(directory)
+    static_mix.save()
+
+def save_dynamic_mix(dynamic_mix, rel_media_path, rel_path):
+    """
+    Renames the separated parts of a dynamic mix, saves them to the storage backend and marks it as done.
+    Provisional preview stems are replaced by the same save, then deleted.
+    """
+    all_parts = get_all_parts(dynamic_mix.separator)
+    file_prefix = get_valid_filename(dynamic_mix.formatted_prefix())
+    file_suffix = dynamic_mix.formatted_suffix()
+    ext = output_format_to_ext(dynamic_mix.bitrate)
+    # Check all parts exist
+    if not exists_all_parts(rel_path, ext, all_parts):
+        raise Exception('Error writing to file')
+
+    rename_all_parts(rel_path, file_prefix, file_suffix, ext, all_parts)
+    preview_names = get_part_names(dynamic_mix) if dynamic_mix.quality_tier == QualityTier.PREVIEW else []
+    dynamic_mix.status = TaskStatus.DONE
+    dynamic_mix.quality_tier = QualityTier.FINAL
+    dynamic_mix.date_finished = timezone.now()
+    if settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage':
+        save_to_local_storage(dynamic_mix, rel_media_path, file_prefix,
+                              file_suffix, ext, all_parts)
+    else:
+        save_to_ext_storage(dynamic_mix, rel_path, file_prefix, file_suffix,
+                            ext, all_parts)
+
+    for name in preview_names:
+        default_storage.delete(name)
+    shutil.rmtree(os.path.join(rel_path, PREVIEW_DIR), ignore_errors=True)
+
+def get_part_files(dynamic_mix):
+    """Returns the files of the parts currently saved for a dynamic mix."""
+    files = [
+        dynamic_mix.vocals_file, dynamic_mix.other_file, dynamic_mix.piano_file,
+        dynamic_mix.bass_file, dynamic_mix.drums_file, dynamic_mix.guitar_file
+    ]
+    return [file for file in files if file]
+
+def get_part_names(dynamic_mix) -> List[str]:
+    """Returns the storage names of the parts currently saved for a dynamic mix."""
+    return [file.name for file in get_part_files(dynamic_mix)]
+
+def discard_preview_dynamic_mix(dynamic_mix):
+    """
+    Deletes the provisional preview parts of a dynamic mix whose final separation failed, so that the failed mix
+    does not keep serving them. The mix is saved by the caller.
+    """
+    if dynamic_mix.quality_tier == QualityTier.PREVIEW:
+        for file in get_part_files(dynamic_mix):
+            default_storage.delete(file.name)
+            file.name = None
+        dynamic_mix.quality_tier = QualityTier.NONE
+    rel_path = os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR, str(dynamic_mix.id))
+    shutil.rmtree(os.path.join(rel_path, PREVIEW_DIR), ignore_errors=True)
+
+def save_preview_dynamic_mix(dynamic_mix, path, offset: float, duration: Optional[float], rel_media_path,
+                             rel_path):
+    """
+    Separates a dynamic mix with Spleeter, which is much faster than the other separators, and saves the parts as
+    provisional files. The mix stays in progress, with preview quality.
+    """
+    all_parts = get_all_parts(dynamic_mix.separator)
+    # Spleeter has no guitar stem, which stays unavailable until the final parts are saved
+    with_piano = 'piano' in all_parts
+    preview_parts = ALL_PARTS_5_PIANO if with_piano else ALL_PARTS
+    preview_rel_media_path = os.path.join(rel_media_path, PREVIEW_DIR)
+    preview_rel_path = os.path.join(rel_path, PREVIEW_DIR)
+    pathlib.Path(preview_rel_path).mkdir(parents=True, exist_ok=True)
+
+    print('Separating preview parts with Spleeter')
+    separator = SpleeterSeparator(settings.CPU_SEPARATION, dynamic_mix.bitrate, with_piano)
+    run_separation(separator.separate_into_parts, path, preview_rel_path, offset, duration)
+
+    file_prefix = get_valid_filename(dynamic_mix.formatted_prefix())
+    file_suffix = '[preview]'
+    ext = output_format_to_ext(dynamic_mix.bitrate)
+    if not exists_all_parts(preview_rel_path, ext, preview_parts):
+        raise Exception('Error writing to file')
+
+    rename_all_parts(preview_rel_path, file_prefix, file_suffix, ext, preview_parts)
+    dynamic_mix.quality_tier = QualityTier.PREVIEW
+    if settings.DEFAULT_FILE_STORAGE == 'api.storage.FileSystemStorage':
+        save_to_local_storage(dynamic_mix, preview_rel_media_path, file_prefix,
+                              file_suffix, ext, preview_parts)
+    else:
+        save_to_ext_storage(dynamic_mix, preview_rel_path, file_prefix, file_suffix,
+                            ext, preview_parts)
+
+def get_chunks(separator, path, offset: float, duration: Optional[float]):
+    """
+    Returns the (start, length) in samples of the overlapping chunks to separate the time range of a track in,
+    relative to offset, or None if the range is separated by a single task.
+    """
+    if settings.CHUNKED_SEPARATION_LENGTH <= 0 or not isinstance(separator, BSRoformerSeparator):
+        return None
+    stem_cache = separator.get_stem_cache(offset, duration)
+    if stem_cache is not None and stem_cache.exists():
+        # Outputs are only mixed from the cached stems
+        return None
+    sample_rate = separator.sample_rate
+    track_duration = float(ffmpeg.probe(path)['format']['duration']) - offset
+    if duration is not None:
+        track_duration = min(track_duration, duration)
+    length = int(max(track_duration, 0) * sample_rate)
+    chunks = plan_chunks(length, settings.CHUNKED_SEPARATION_LENGTH * sample_rate,
+                         get_chunk_overlap(separator))
+    return chunks if len(chunks) > 1 else None
+
+def get_chunk_overlap(separator) -> int:
+    """Returns the number of samples shared by consecutive chunks."""
+    return settings.CHUNKED_SEPARATION_OVERLAP * separator.sample_rate
+
+def get_stem_cache_dir(mix) -> str:
+    """Returns the directory holding the cached raw stems of the source track of a mix."""
+    source_file_id = str(mix.source_track.source_file.id)
+    return os.path.join(settings.MEDIA_ROOT, settings.UPLOAD_DIR, source_file_id, 'stems')
+
+def get_chunks_dir(mix_id) -> str:
+    """Returns the directory holding the separated chunks of a mix."""
+    return os.path.join(settings.MEDIA_ROOT, settings.SEPARATE_DIR, str(mix_id), 'chunks')
+
+def start_chunked_separation(mix_type: str, mix_id: str, chunks, callback):
+    """
+    Separates the chunks of the source track of a mix in parallel tasks, then runs callback with the list of their
+    directories. The mix is marked as failed if any of the tasks fails.
+    """
+    print(f'Separating track in {len(chunks)} chunks')
+    header = [
+        separate_chunk.s(mix_type, mix_id, os.path.join(get_chunks_dir(mix_id), str(idx)), start, length)
+        for idx, (start, length) in enumerate(chunks)
+    ]
+    chord(header)(callback.on_error(fail_chunked_mix.s(mix_type, mix_id)))
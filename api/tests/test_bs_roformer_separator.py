@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+from django.test import SimpleTestCase, override_settings
+from omegaconf import OmegaConf
+
+from api.separators.bs_roformer import BSRoformer
+from api.separators.bs_roformer_separator import BSRoformerSeparator
+
+STEMS = ['bass', 'drums', 'other', 'vocals', 'guitar', 'piano']
+
+
+@override_settings(BS_ROFORMER_STREAMING=False, BS_ROFORMER_PRUNE_STEMS=False, BS_ROFORMER_COMPILE='',
+                   BS_ROFORMER_SILENCE_THRESHOLD=None, BS_ROFORMER_DUAL_MONO_THRESHOLD=None,
+                   BS_ROFORMER_SEGMENT_MEMO_SIZE=0, BS_ROFORMER_PROCESSES=1, BS_ROFORMER_PRECISION='fp32',
+                   INFERENCE_SERVER_ADDRESS='')
+class BSRoformerSeparatorTest(SimpleTestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        # Small untrained model with the STFT of the released checkpoints
+        self.model = BSRoformer(dim=32, depth=1, stereo=True, num_stems=len(STEMS), time_transformer_depth=1,
+                                freq_transformer_depth=1, mask_estimator_depth=2).eval()
+
+    def make_separator(self, spectral: bool) -> BSRoformerSeparator:
+        with self.settings(BS_ROFORMER_SPECTRAL=spectral):
+            separator = BSRoformerSeparator(cpu_separation=True, use_inference_server=False)
+        separator.config = OmegaConf.create({
+            'inference': {'dim_t': 17, 'num_overlap': 2, 'batch_size': 2},
+            'model': {'stft_hop_length': 512},
+            'training': {'instruments': STEMS},
+        })
+        return separator
+
+    def demix(self, spectral: bool, mix: np.ndarray):
+        with torch.inference_mode():
+            return self.make_separator(spectral).demix(mix, self.model)
+
+    def test_spectral_very_short_mix(self):
+        """Mixes too short to be reflect-padded for the STFT are separated."""
+        mix = np.random.default_rng(0).uniform(-0.5, 0.5, (2, 100)).astype(np.float32)
+        output = self.demix(True, mix)
+        self.assertEqual(set(output), set(STEMS))
+        for stem in output.values():
+            self.assertEqual(stem.shape, mix.shape)
+
+    def test_spectral_mix_shorter_than_segment(self):
+        """Mixes shorter than one segment are separated like in the waveform domain."""
+        separator = self.make_separator(True)
+        C, _, _ = separator._get_segment_params()
+        mix = np.random.default_rng(0).uniform(-0.5, 0.5, (2, C - 1)).astype(np.float32)
+        spectral = self.demix(True, mix)
+        waveform = self.demix(False, mix)
+        for stem in STEMS:
+            np.testing.assert_array_equal(spectral[stem], waveform[stem])
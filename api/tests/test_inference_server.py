@@ -0,0 +1,50 @@
+from threading import Thread
+
+import torch
+from django.test import SimpleTestCase
+
+from api.separators.inference_server import InferenceRequest, InferenceServer
+
+
+class PassthroughModel(torch.nn.Module):
+    """Returns its input as a single stem, counting the forward passes run."""
+    def __init__(self):
+        super().__init__()
+        self.scale = torch.nn.Parameter(torch.ones(1))
+        self.calls = 0
+
+    def forward(self, x, stem_groups=None, complement_groups=None):
+        self.calls += 1
+        return (x * self.scale)[:, None]
+
+
+class InferenceServerTest(SimpleTestCase):
+    def setUp(self):
+        self.model = PassthroughModel()
+        self.server = InferenceServer('unused', lambda model_args: self.model, max_batch_size=8, max_delay=0.5)
+        Thread(target=self.server.run_batches, daemon=True).start()
+
+    def submit(self, batch: torch.Tensor) -> InferenceRequest:
+        request = InferenceRequest({'stem_mode': '4stem'}, None, None, batch)
+        self.server.requests.put(request)
+        return request
+
+    def test_mono_and_stereo_requests(self):
+        """Dual mono and stereo segments of the same model are run in separate batches."""
+        mono = self.submit(torch.randn(2, 1, 64))
+        stereo = self.submit(torch.randn(3, 2, 64))
+        for request in (mono, stereo):
+            self.assertTrue(request.done.wait(timeout=10))
+            self.assertIsNone(request.error)
+            self.assertEqual(request.output.shape, (request.batch.shape[0], 1, *request.batch.shape[1:]))
+            torch.testing.assert_close(torch.from_numpy(request.output)[:, 0], request.batch)
+        self.assertEqual(self.model.calls, 2)
+
+    def test_batches_same_shape(self):
+        """Requests with the same model and segment shape share a forward pass."""
+        first = self.submit(torch.randn(2, 2, 64))
+        second = self.submit(torch.randn(1, 2, 64))
+        for request in (first, second):
+            self.assertTrue(request.done.wait(timeout=10))
+            self.assertIsNone(request.error)
+        self.assertEqual(self.model.calls, 1)
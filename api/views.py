@@ -327,6 +327,14 @@ class DynamicMixCreateView(generics.ListCreateAPIView):
                     'errors': [serializer.errors['args']]
                 },
                 status=400)
+        elif 'time_range' in serializer.errors:
+            # Invalid start or end time given
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'errors': [serializer.errors['time_range']]
+                },
+                status=400)
 
         return JsonResponse({
             'status': 'error',
@@ -397,6 +405,14 @@ class StaticMixCreateView(generics.ListCreateAPIView):
                     'errors': [serializer.errors['args']]
                 },
                 status=400)
+        elif 'time_range' in serializer.errors:
+            # Invalid start or end time given
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'errors': [serializer.errors['time_range']]
+                },
+                status=400)
 
         return JsonResponse(
             {
@@ -72,6 +72,18 @@ CELERY_TASK_ROUTES = {
     'api.tasks.create_dynamic_mix': {
         'queue': 'slow_queue'
     },
+    'api.tasks.separate_chunk': {
+        'queue': 'slow_queue'
+    },
+    'api.tasks.finish_chunked_static_mix': {
+        'queue': 'slow_queue'
+    },
+    'api.tasks.finish_chunked_dynamic_mix': {
+        'queue': 'slow_queue'
+    },
+    'api.tasks.fail_chunked_mix': {
+        'queue': 'fast_queue'
+    },
     'api.tasks.fetch_youtube_audio': {
         'queue': 'fast_queue'
     },
@@ -79,6 +91,57 @@ CELERY_TASK_ROUTES = {
 
 DEMUCS_SEGMENT_SIZE = os.getenv('DEMUCS_SEGMENT_SIZE')
 
+# Maximum number of separation models each worker process keeps loaded between tasks (0 disables caching)
+MODEL_CACHE_SIZE = int(os.getenv('MODEL_CACHE_SIZE', 1))
+# Memory budget in MB for models kept loaded by each worker process (0 for no limit)
+MODEL_CACHE_MEMORY_LIMIT = int(os.getenv('MODEL_CACHE_MEMORY_LIMIT', 0))
+
+# Whether BS-RoFormer decodes, separates and encodes tracks incrementally, keeping memory usage constant regardless of track length
+BS_ROFORMER_STREAMING = os.getenv('BS_ROFORMER_STREAMING', '0') == '1'
+# Whether BS-RoFormer computes the STFT of the whole track once and overlap-adds segments in the spectrogram domain
+BS_ROFORMER_SPECTRAL = os.getenv('BS_ROFORMER_SPECTRAL', '0') == '1'
+# Whether BS-RoFormer models are loaded with only the mask estimators of the stems a job needs
+BS_ROFORMER_PRUNE_STEMS = os.getenv('BS_ROFORMER_PRUNE_STEMS', '0') == '1'
+# How BS-RoFormer models are compiled for inference: 'trace' (TorchScript), 'compile' (torch.compile), 'onnx' (ONNX Runtime) or empty for eager mode
+BS_ROFORMER_COMPILE = os.getenv('BS_ROFORMER_COMPILE', '').lower()
+# RMS level in dBFS below which BS-RoFormer segments are treated as silent and not separated (empty to separate every segment)
+BS_ROFORMER_SILENCE_THRESHOLD = float(os.getenv('BS_ROFORMER_SILENCE_THRESHOLD')) if os.getenv('BS_ROFORMER_SILENCE_THRESHOLD') else None
+# Level in dB of the difference between the channels of a track, relative to its peak, below which BS-RoFormer separates it as dual mono (empty to always separate both channels)
+BS_ROFORMER_DUAL_MONO_THRESHOLD = float(os.getenv('BS_ROFORMER_DUAL_MONO_THRESHOLD')) if os.getenv('BS_ROFORMER_DUAL_MONO_THRESHOLD') else None
+# Number of segment outputs BS-RoFormer keeps per job to reuse for bit-identical segments, e.g. repeated loops (0 to disable)
+BS_ROFORMER_SEGMENT_MEMO_SIZE = int(os.getenv('BS_ROFORMER_SEGMENT_MEMO_SIZE', 0))
+# Whether BS-RoFormer caches the raw stems of each source track, so that later mixes of the same track are only mixed and encoded
+BS_ROFORMER_STEM_CACHE = os.getenv('BS_ROFORMER_STEM_CACHE', '0') == '1'
+# Number of processes the segments of a track are sharded across for CPU separation with BS-RoFormer, each using an equal share of the threads
+BS_ROFORMER_PROCESSES = int(os.getenv('BS_ROFORMER_PROCESSES', 1))
+# Number of threads used by ONNX Runtime within and across operators (0 for the ONNX Runtime default)
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))
+ONNX_INTER_OP_THREADS = int(os.getenv('ONNX_INTER_OP_THREADS', '0'))
+# Default precision of BS-RoFormer models: 'fp32', or 'bf16' to hold weights in bfloat16 and run the transformers under autocast
+BS_ROFORMER_PRECISION = os.getenv('BS_ROFORMER_PRECISION', 'fp32').lower()
+
+# Length in seconds of the chunks that BS-RoFormer tracks are split into, to be separated in parallel by several workers (0 to separate each track in a single task)
+CHUNKED_SEPARATION_LENGTH = int(os.getenv('CHUNKED_SEPARATION_LENGTH', 0))
+# Seconds of audio shared by consecutive chunks, over which their outputs are crossfaded
+CHUNKED_SEPARATION_OVERLAP = int(os.getenv('CHUNKED_SEPARATION_OVERLAP', 10))
+# Path of the Unix socket of the local inference server that runs BS-RoFormer models for all workers of a host (empty to run models in each worker)
+INFERENCE_SERVER_ADDRESS = os.getenv('INFERENCE_SERVER_ADDRESS', '')
+# Number of segments above which the inference server runs a batch without waiting for more requests
+INFERENCE_SERVER_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_SERVER_MAX_BATCH_SIZE', 8))
+# Milliseconds a request may wait on the inference server to be batched with requests from other jobs
+INFERENCE_SERVER_MAX_DELAY = int(os.getenv('INFERENCE_SERVER_MAX_DELAY', 50))
+# Maximum number of models the inference server keeps loaded, e.g. one per precision or quantization mode requested by jobs
+INFERENCE_SERVER_MODEL_CACHE_SIZE = int(os.getenv('INFERENCE_SERVER_MODEL_CACHE_SIZE', 3))
+
+# Whether each separation worker process is pinned to its own share of the CPUs and NUMA nodes, with thread pools sized to match
+CPU_PINNING = os.getenv('CPU_PINNING', '0') == '1'
+
+# Comma-separated list of separators (e.g. 'bs_roformer,htdemucs') to download and load when a separation worker starts
+WARMUP_SEPARATORS = [sep.strip() for sep in os.getenv('WARMUP_SEPARATORS', '').split(',') if sep.strip()]
+if WARMUP_SEPARATORS:
+    # Give worker processes enough time to load models before they are considered unresponsive
+    CELERY_WORKER_PROC_ALIVE_TIMEOUT = int(os.getenv('CELERY_WORKER_PROC_ALIVE_TIMEOUT', 600))
+
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 DATABASES = {